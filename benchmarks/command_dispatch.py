@@ -0,0 +1,58 @@
+"""
+Micro-benchmark of the per-command overhead of Device command dispatch.
+
+Compares evaluating each command string with eval("device." + cmd), as
+Device.run() used to do, with the cached CommandDispatcher. Run from the
+repository root:
+
+    python benchmarks/command_dispatch.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from main import CommandDispatcher
+
+class BenchmarkDriver:
+    def __init__(self):
+        self.verification_string = "test"
+
+    def ReadValue(self):
+        return [0.0, 1.0]
+
+    def CheckFlood(self):
+        return "no flood"
+
+    def SetFrequency(self, freq):
+        return freq
+
+    def SetTriggerMode(self, mode, enabled=True):
+        return mode
+
+COMMANDS = [
+        "ReadValue()",
+        "CheckFlood()",
+        "SetFrequency(100e6)",
+        "SetTriggerMode('disabled', enabled=False)",
+        "verification_string",
+    ]
+
+def main(number=100000):
+    device = BenchmarkDriver()
+    dispatch = CommandDispatcher(device)
+
+    print("{0:45s} {1:>12s} {2:>12s} {3:>8s}".format("command", "eval [us]", "dispatch [us]", "speedup"))
+    for cmd in COMMANDS:
+        t_eval = timeit.timeit(
+                lambda: eval("device." + cmd.strip(), globals(), {"device": device}),
+                number=number
+            )
+        t_dispatch = timeit.timeit(lambda: dispatch(cmd), number=number)
+        print("{0:45s} {1:12.3f} {2:12.3f} {3:8.1f}".format(
+                cmd, 1e6*t_eval/number, 1e6*t_dispatch/number, t_eval/t_dispatch
+            ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark of writing uncompressed PXIe5171-like int16 records to HDF.
+
+Compares, for records that are views of one flat buffer as returned by the
+driver's fetch_into(), the default layout (a dataset per record, written
+transposed), the extendable layout written through h5py (stacking the records
+first), and the extendable layout written with write_direct_chunk() from the
+buffer, as the HDF_writer does for uncompressed records. Reports the write rate
+and the memory allocated for copies per record (the tracemalloc peak). Run
+from the repository root:
+
+    python benchmarks/fast_write_path.py
+"""
+
+import time
+import tempfile
+import tracemalloc
+import h5py
+import numpy as np
+from pathlib import Path
+
+def make_buffer(n_records, n_channels, n_samples):
+    flat = np.random.normal(0, 20, n_records*n_channels*n_samples).astype(np.int16)
+    return flat.reshape(n_records, n_channels, n_samples)
+
+def write_datasets(f, records):
+    grp = f.require_group("datasets")
+    for record in records:
+        grp.create_dataset("trace_" + str(len(grp)), data=record.T, dtype=np.int16)
+
+def write_stacked(f, records):
+    dset = f["extendable"]
+    n0 = dset.shape[0]
+    dset.resize(n0 + len(records), axis=0)
+    dset[n0:] = np.stack(records)
+
+def write_direct(f, records):
+    dset = f["extendable"]
+    n0 = dset.shape[0]
+    dset.resize(n0 + len(records), axis=0)
+    for i, record in enumerate(records):
+        chunk = np.ascontiguousarray(record, dtype=dset.dtype)
+        dset.id.write_direct_chunk((n0+i,) + (0,)*(dset.ndim-1), chunk)
+
+def run(write, buf, batch):
+    with tempfile.TemporaryDirectory() as tmp:
+        with h5py.File(Path(tmp) / "bench.hdf", "w") as f:
+            f.create_dataset("extendable", (0,) + buf.shape[1:], maxshape=(None,) + buf.shape[1:],
+                    chunks=(1,) + buf.shape[1:], dtype=np.int16)
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            for i in range(0, len(buf), batch):
+                write(f, list(buf[i:i+batch]))
+            dt = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return buf.nbytes / dt / 1e6, peak / batch / buf[0].nbytes
+
+def main(n_records=2000, n_channels=4, n_samples=2000, batch=10):
+    buf = make_buffer(n_records, n_channels, n_samples)
+    print("{0} records of {1} channels x {2} samples, {3} per loop".format(
+        n_records, n_channels, n_samples, batch))
+    print("{0:12s} {1:>10s} {2:>22s}".format("path", "[MB/s]", "copies [records/record]"))
+    for name, write in [("datasets", write_datasets), ("stacked", write_stacked), ("direct", write_direct)]:
+        rate, copies = run(write, buf, batch)
+        print("{0:12s} {1:10.1f} {2:22.2f}".format(name, rate, copies))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark of chunk shape and chunk cache size for slow-device datasets.
+
+Simulates a run of a slow device as written by the HDF_writer: a batch of rows
+appended every loop, reopening the file each time (or keeping it open, as in
+SWMR mode), comparing the chunks h5py picks by default with those from
+chunk_shape(), and the default chunk cache with the writer's (none). Each is
+run twice: from an empty dataset (a short run), and after --days of rows at
+the device dt (a long run, filled in large batches to save time), where the
+number of chunks and the size of the B-tree indexing them matter. Reports the
+time per loop, the file size and number of chunks, and the time to read a
+whole column and the last rows, as the Plotter does. Run from the repository
+root, e.g.:
+
+    python benchmarks/hdf_chunking.py --days 3
+"""
+
+import sys
+import time
+import argparse
+import tempfile
+import h5py
+import numpy as np
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from main import chunk_shape
+
+def fill(fname, dtype, chunks, n_rows, batch=10**5):
+    # the dataset as left by a long run (created empty, so that h5py picks its
+    # default chunks as for the writer's datasets)
+    rows = np.zeros(batch, dtype=dtype)
+    with h5py.File(fname, "w") as f:
+        dset = f.create_dataset("dev", (0,), maxshape=(None,), dtype=dtype, chunks=chunks)
+        dset.resize(n_rows, axis=0)
+        for i in range(0, n_rows, batch):
+            n = min(batch, n_rows - i)
+            dset[i:i+n] = rows[:n]
+
+def write(fname, dtype, file_kwargs, rows_per_loop, n_loops, keep_open):
+    rows = np.zeros(rows_per_loop, dtype=dtype)
+    f = h5py.File(fname, "a", **file_kwargs) if keep_open else None
+    t0 = time.perf_counter()
+    for _ in range(n_loops):
+        g = f if keep_open else h5py.File(fname, "a", **file_kwargs)
+        dset = g["dev"]
+        dset.resize(dset.shape[0]+rows_per_loop, axis=0)
+        dset[-rows_per_loop:] = rows
+        if keep_open:
+            g.flush()
+        else:
+            g.close()
+    t = time.perf_counter() - t0
+    if keep_open:
+        f.close()
+    return t / n_loops
+
+def read(fname):
+    with h5py.File(fname, "r") as f:
+        dset = f["dev"]
+        t0 = time.perf_counter()
+        dset[dset.dtype.names[1]]
+        t_column = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        dset[-100:]
+        t_last = time.perf_counter() - t0
+        return t_column, t_last, dset.id.get_num_chunks()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--columns", type=int, default=8, help="columns of the device")
+    parser.add_argument("--dt", type=float, default=0.1, help="device polling dt [s]")
+    parser.add_argument("--loop-delay", type=float, default=0.1, help="hdf_loop_delay [s]")
+    parser.add_argument("--loops", type=int, default=2000, help="loops timed in each run")
+    parser.add_argument("--days", type=float, default=3, help="length of the long run [days]")
+    args = parser.parse_args()
+
+    dtype = np.dtype([("time", "f8")] + [("ch" + str(i), "f4") for i in range(args.columns-1)])
+    rows_per_loop = max(int(args.loop_delay / args.dt), 1)
+    n_rows_long = int(args.days * 86400 / args.dt)
+    print("{0} rows of {1} bytes every {2} s, {3} loops; long run after {4} rows ({5} days)".format(
+        rows_per_loop, dtype.itemsize, args.loop_delay, args.loops, n_rows_long, args.days))
+    print("{0:6s} {1:8s} {2:>9s} {3:>12s} {4:>10s} {5:>10s} {6:>8s} {7:>12s} {8:>10s}".format(
+        "run", "chunks", "cache", "file", "loop [ms]", "size [MB]", "chunks", "column [ms]", "last [ms]"))
+    for run_name, n_rows in [("short", 0), ("long", n_rows_long)]:
+        for chunks_name, chunks in [("default", True), ("tuned", chunk_shape((), dtype, args.dt))]:
+            for cache_name, file_kwargs in [("default", {}), ("none", {"rdcc_nbytes": 0})]:
+                for keep_open in [False, True]:
+                    with tempfile.TemporaryDirectory() as tmp:
+                        fname = Path(tmp) / "bench.hdf"
+                        fill(fname, dtype, chunks, n_rows)
+                        t_loop = write(fname, dtype, file_kwargs, rows_per_loop, args.loops, keep_open)
+                        t_column, t_last, n_chunks = read(fname)
+                        print("{0:6s} {1:8s} {2:>9s} {3:>12s} {4:10.3f} {5:10.2f} {6:8d} {7:12.3f} {8:10.3f}".format(
+                            run_name, chunks_name, cache_name, "kept open" if keep_open else "reopened",
+                            1e3*t_loop, fname.stat().st_size/1e6, n_chunks,
+                            1e3*t_column, 1e3*t_last))
+
+if __name__ == "__main__":
+    main()
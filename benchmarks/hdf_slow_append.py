@@ -0,0 +1,62 @@
+"""
+Benchmark of appending slow-device rows to an HDF dataset.
+
+Compares the former HDF_writer approach (converting and writing each queued
+row separately) with converting the whole batch to one structured array and
+writing it with a single slice assignment. Run from the repository root:
+
+    python benchmarks/hdf_slow_append.py
+"""
+
+import sys
+import time
+import tempfile
+import h5py
+import numpy as np
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from main import rows_to_structured_array
+
+COLUMNS = ["time", "ch0", "ch1", "ch2", "ch3", "ch4", "ch5", "ch6"]
+
+def make_rows(n):
+    return [[float(i)] + [np.random.rand() for _ in COLUMNS[1:]] for i in range(n)]
+
+def append_per_row(dset, rows):
+    list_len = len(rows)
+    dset.resize(dset.shape[0]+list_len, axis=0)
+    for idx, d in enumerate(rows):
+        idx_start = -list_len + idx
+        idx_stop = -list_len+idx+1
+        d = np.array([tuple(d)], dtype = dset.dtype)
+        if idx_stop == 0:
+            dset[idx_start:] = d
+        else:
+            dset[idx_start:idx_stop] = d
+
+def append_batch(dset, rows):
+    data = rows_to_structured_array(rows, dset.dtype)
+    dset.resize(dset.shape[0]+len(data), axis=0)
+    dset[-len(data):] = data
+
+def run(append, batch_size, n_batches):
+    dtype = np.dtype([(name, "f") for name in COLUMNS])
+    batches = [make_rows(batch_size) for _ in range(n_batches)]
+    with tempfile.TemporaryDirectory() as tmp:
+        with h5py.File(Path(tmp) / "bench.hdf", "w") as f:
+            dset = f.create_dataset("dev", (0,), maxshape=(None,), dtype=dtype)
+            t0 = time.perf_counter()
+            for rows in batches:
+                append(dset, rows)
+            return batch_size * n_batches / (time.perf_counter() - t0)
+
+def main(n_batches=200):
+    print("{0:>10s} {1:>15s} {2:>15s} {3:>8s}".format("batch", "per row [1/s]", "batch [1/s]", "speedup"))
+    for batch_size in [1, 10, 100, 1000]:
+        r_old = run(append_per_row, batch_size, n_batches)
+        r_new = run(append_batch, batch_size, n_batches)
+        print("{0:10d} {1:15.0f} {2:15.0f} {3:8.1f}".format(batch_size, r_old, r_new, r_new/r_old))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Throughput benchmark of the acquisition stack: Device threads and HDF_writer.
+
+Runs, without the GUI, a number of synthetic slow devices (rows of columns,
+like DummyDataFreq) and fast devices (traces of channels x samples, like
+DummyDataTrace) at the chosen rates, with the HDF writer(s) configured as in
+settings.ini, for a given duration. Reports the rate at which data is written,
+the growth of the device queues (sustained growth means the writer cannot keep
+up), the period of the writer loop, the device loop jitter, and the peak memory
+of the process. The results are saved as JSON, so that runs can be compared
+over time. Run from the repository root, e.g.:
+
+    python benchmarks/hdf_writer_throughput.py --slow 20 --slow-rate 10 \\
+        --fast 2 --fast-rate 50 --channels 4 --samples 2000 --duration 60
+
+See --help for all options.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import functools
+import threading
+import numpy as np
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from main import Device, HDF_writer, TimingHistogram
+
+class SyntheticSlow:
+    def __init__(self, time_offset, n_columns):
+        self.time_offset = time_offset
+        self.warnings = []
+        self.new_attributes = []
+        self.verification_string = "test"
+        self.shape = (n_columns,)
+        self.dtype = "f8"
+        self.rng = np.random.default_rng()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def GetWarnings(self):
+        return self.warnings
+
+    def ReadValue(self):
+        return [time.time() - self.time_offset] + list(self.rng.random(self.shape[0]-1))
+
+class SyntheticTrace:
+    def __init__(self, time_offset, n_channels, n_samples):
+        self.time_offset = time_offset
+        self.warnings = []
+        self.new_attributes = []
+        self.verification_string = "test"
+        self.shape = (1, n_channels, n_samples)
+        self.dtype = "int16"
+        self.rng = np.random.default_rng()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def GetWarnings(self):
+        return self.warnings
+
+    def ReadValue(self):
+        t = time.time() - self.time_offset
+        trace = self.rng.normal(0, 20, self.shape).astype(np.int16)
+        return [trace, [{"timestamp": t}]]
+
+class HeadlessParent:
+    """Stands in for CentrexGUI and its ControlGUI: the configuration and
+    devices that the HDF writers use."""
+    def __init__(self, config, devices):
+        self.config = config
+        self.devices = devices
+        self.ControlGUI = self
+        self.HDF_writers = []
+
+    def n_HDF_shards(self):
+        return max(int(self.config["general"]["hdf_writer_shards"]), 1)
+
+    def update_HDF_status(self):
+        pass
+
+def device_config(name, driver_class, rate, slow, shape, dtype, args):
+    columns = ["time"] + ["ch" + str(i) for i in range(shape[0]-1)] if slow else ["ch" + str(i) for i in range(shape[1])]
+    return {
+            "name"               : name,
+            "path"               : "benchmark",
+            "driver_class"       : driver_class,
+            "constr_params"      : [],
+            "correct_response"   : "test",
+            "slow_data"          : slow,
+            "meta_device"        : False,
+            "double_connect_dev" : False,
+            "compound_dataset"   : False,
+            "plots_queue_maxlen" : 100,
+            "max_NaN_count"      : 10,
+            "shape"              : shape,
+            "dtype"              : dtype,
+            "fast_data_layout"   : args.layout,
+            "compression"        : "" if slow else args.compression,
+            "compression_level"  : args.compression_level,
+            "shuffle"            : True,
+            "attributes"         : {"column_names": ",".join(columns), "units": ",".join("" for _ in columns)},
+            "control_params"     : {
+                "enabled"     : {"value": 2},
+                "HDF_enabled" : {"value": 1},
+                "dt"          : {"value": 1/rate},
+            },
+        }
+
+def make_devices(args):
+    devices = {}
+    for i in range(args.slow):
+        driver = functools.partial(SyntheticSlow, n_columns=args.columns)
+        devices["slow" + str(i)] = Device(device_config("slow" + str(i), driver,
+            args.slow_rate, True, (args.columns,), "f8", args))
+    for i in range(args.fast):
+        driver = functools.partial(SyntheticTrace, n_channels=args.channels, n_samples=args.samples)
+        devices["fast" + str(i)] = Device(device_config("fast" + str(i), driver,
+            args.fast_rate, False, (1, args.channels, args.samples), "int16", args))
+    return devices
+
+def peak_memory_MB():
+    # peak resident memory of the process
+    if sys.platform == "win32":
+        import ctypes, ctypes.wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", ctypes.wintypes.DWORD), ("PageFaultCount", ctypes.wintypes.DWORD)] \
+                    + [(name, ctypes.c_size_t) for name in ["PeakWorkingSetSize", "WorkingSetSize",
+                        "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                        "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage"]]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / 1e6
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+def queued(devices, slow):
+    return sum(len(dev.data_queue) for dev in devices.values() if dev.config["slow_data"] == slow)
+
+def read(devices, slow):
+    return sum(dev.read_count for dev in devices.values() if dev.config["slow_data"] == slow)
+
+def sample(parent, devices, active, samples, loop_periods):
+    # watch the queues, and the writer loops (as they update time_last_loop)
+    last_loops = [w.time_last_loop for w in parent.HDF_writers]
+    t_sample = 0
+    while active.is_set():
+        for i, w in enumerate(parent.HDF_writers):
+            if w.time_last_loop != last_loops[i]:
+                loop_periods.add(w.time_last_loop - last_loops[i])
+                last_loops[i] = w.time_last_loop
+        if time.time() - t_sample >= 0.1:
+            t_sample = time.time()
+            samples.append((t_sample, queued(devices, True), queued(devices, False)))
+        time.sleep(0.002)
+
+def queue_growth(samples, column):
+    # the slope of a linear fit to the queue depth, in entries per second
+    if len(samples) < 2:
+        return 0
+    t = np.array([s[0] for s in samples])
+    depth = np.array([s[column] for s in samples])
+    return float(np.polyfit(t - t[0], depth, 1)[0])
+
+def files_size_MB(hdf_fname):
+    path = Path(hdf_fname)
+    return sum(f.stat().st_size for f in path.parent.glob(path.stem + "*" + path.suffix)) / 1e6
+
+def run(args, tmp):
+    hdf_fname = str(Path(tmp) / "benchmark.hdf")
+    config = {
+            "general": {
+                "run_name"                : "benchmark",
+                "hdf_loop_delay"          : str(args.loop_delay),
+                "default_hdf_dt"          : "1.0",
+                "hdf_swmr"                : str(args.swmr),
+                "hdf_compression_workers" : str(args.compression_workers),
+                "hdf_writer_shards"       : str(args.shards),
+                "hdf_rotate_mb"           : str(args.rotate_mb),
+                "hdf_rotate_minutes"      : "0",
+            },
+            "files": {
+                "hdf_fname"     : hdf_fname,
+                "journal_fname" : str(Path(tmp) / "benchmark.journal") if args.journal else "",
+            },
+            "run_attributes" : {},
+            "time_offset"    : time.time(),
+        }
+    devices = make_devices(args)
+    parent = HeadlessParent(config, devices)
+    for dev in devices.values():
+        dev.setup_connection(config["time_offset"])
+
+    # the writers, as started by ControlGUI.start_control()
+    run_name = None
+    for shard, dev_names in enumerate(HDF_writer.assign_shards(devices, parent.n_HDF_shards())):
+        writer = HDF_writer(parent, run_name=run_name, shard=shard, dev_names=dev_names)
+        run_name = writer.run_name
+        parent.HDF_writers.append(writer)
+        for dev_name in dev_names:
+            devices[dev_name].journal = writer.journal
+    for writer in parent.HDF_writers:
+        writer.start()
+    for dev in devices.values():
+        dev.start()
+
+    # let the queues settle, then measure for the given duration
+    samples, loop_periods = [], TimingHistogram()
+    sampling = threading.Event()
+    sampling.set()
+    sampler = threading.Thread(target=sample, args=(parent, devices, sampling, samples, loop_periods))
+    time.sleep(args.warmup)
+    sampler.start()
+    t0 = time.time()
+    read0 = {slow: read(devices, slow) - queued(devices, slow) for slow in [True, False]}
+    size0 = files_size_MB(hdf_fname)
+    time.sleep(args.duration)
+    t1 = time.time()
+    read1 = {slow: read(devices, slow) - queued(devices, slow) for slow in [True, False]}
+    size1 = files_size_MB(hdf_fname)
+
+    # stop the devices, and time how long the writers take to catch up
+    for dev in devices.values():
+        dev.active.clear()
+        dev.wakeup.set()
+    for dev in devices.values():
+        dev.join()
+    backlog = {"slow_rows": queued(devices, True), "fast_records": queued(devices, False)}
+    t_stop = time.time()
+    for writer in parent.HDF_writers:
+        writer.active.clear()
+    for writer in parent.HDF_writers:
+        writer.join()
+    drain_s = time.time() - t_stop
+    sampling.clear()
+    sampler.join()
+
+    slow_rows = read1[True] - read0[True]
+    fast_records = read1[False] - read0[False]
+    dt = t1 - t0
+    return {
+            "slow_rows_per_s"         : slow_rows / dt,
+            "slow_MB_per_s"           : slow_rows * 8 * args.columns / dt / 1e6,
+            "fast_records_per_s"      : fast_records / dt,
+            "fast_MB_per_s"           : fast_records * 2 * args.channels * args.samples / dt / 1e6,
+            "file_MB_per_s"           : (size1 - size0) / dt,
+            "offered_slow_rows_per_s" : args.slow * args.slow_rate,
+            "offered_fast_records_per_s" : args.fast * args.fast_rate,
+            "slow_queue_growth_per_s" : queue_growth(samples, 1),
+            "fast_queue_growth_per_s" : queue_growth(samples, 2),
+            "max_slow_queue"          : max((s[1] for s in samples), default=0),
+            "max_fast_queue"          : max((s[2] for s in samples), default=0),
+            "backlog_at_stop"         : backlog,
+            "drain_s"                 : drain_s,
+            "writer_loop_period"      : loop_periods.summary(),
+            "device_jitter"           : {name: dev.metrics.summary().get("jitter")
+                                            for name, dev in devices.items()},
+            "peak_memory_MB"          : peak_memory_MB(),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--slow", type=int, default=10, help="number of slow devices")
+    parser.add_argument("--slow-rate", type=float, default=10, help="rows per second per slow device")
+    parser.add_argument("--columns", type=int, default=8, help="columns per slow-device row, including time")
+    parser.add_argument("--fast", type=int, default=1, help="number of fast devices")
+    parser.add_argument("--fast-rate", type=float, default=10, help="records per second per fast device")
+    parser.add_argument("--channels", type=int, default=2, help="channels per fast-device record")
+    parser.add_argument("--samples", type=int, default=2000, help="samples per channel")
+    parser.add_argument("--layout", choices=["datasets", "extendable"], default="extendable",
+            help="fast_data_layout of the fast devices")
+    parser.add_argument("--compression", default="", help="compression of the fast devices, e.g. gzip")
+    parser.add_argument("--compression-level", default="")
+    parser.add_argument("--compression-workers", type=int, default=2)
+    parser.add_argument("--shards", type=int, default=1, help="hdf_writer_shards")
+    parser.add_argument("--rotate-mb", type=float, default=0, help="hdf_rotate_mb")
+    parser.add_argument("--swmr", action="store_true", help="hdf_swmr")
+    parser.add_argument("--journal", action="store_true", help="write the journal")
+    parser.add_argument("--loop-delay", type=float, default=0.1, help="hdf_loop_delay")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds before measuring")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to measure")
+    parser.add_argument("--dir", default=None, help="directory for the HDF files (default: temporary)")
+    parser.add_argument("--output", default="hdf_writer_throughput.json", help="JSON file to append the results to")
+    args = parser.parse_args()
+
+    if args.dir:
+        os.makedirs(args.dir, exist_ok=True)
+        results = run(args, tempfile.mkdtemp(dir=args.dir))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = run(args, tmp)
+
+    print(json.dumps(results, indent=4))
+
+    # keep a list of runs, to compare against earlier ones
+    runs = []
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            runs = json.load(f)
+    runs.append({
+            "time"       : time.strftime("%Y-%m-%d %H:%M:%S"),
+            "platform"   : platform.platform(),
+            "python"     : platform.python_version(),
+            "parameters" : vars(args),
+            "results"    : results,
+        })
+    with open(args.output, "w") as f:
+        json.dump(runs, f, indent=4)
+
+if __name__ == "__main__":
+    main()
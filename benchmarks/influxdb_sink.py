@@ -0,0 +1,125 @@
+"""
+Exercise of the InfluxDBSink against a local stand-in for the InfluxDB server.
+
+Starts an HTTP server on localhost that accepts line-protocol writes on /write
+(as InfluxDB 1.x does) and can be made unavailable, then writes points from
+several producer threads at a given rate while the server goes down and comes
+back. Reports how long write() takes for the producers, how many points were
+buffered in memory and on disk during the outage, and checks that all points
+arrived, in order for each producer. Run from the repository root:
+
+    python benchmarks/influxdb_sink.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+import http.server
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from main import InfluxDBSink
+
+class StandIn(http.server.ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.available = True
+        self.lines = []
+        self.n_requests = 0
+        self.lock = threading.Lock()
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.server.available:
+            self.send_response(503)
+            self.end_headers()
+            return
+        with self.server.lock:
+            self.server.n_requests += 1
+            self.server.lines.extend(body.decode().splitlines())
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def produce(sink, name, rate, duration, write_times):
+    t_end = time.time() + duration
+    i = 0
+    while time.time() < t_end:
+        t0 = time.perf_counter()
+        sink.write(name, {"run_name": "benchmark"}, {"i": i, "value": float(i)}, 1000*time.time())
+        write_times.append(time.perf_counter() - t0)
+        i += 1
+        time.sleep(1/rate)
+    return i
+
+def main(n_producers=10, rate=100, duration=12, outage=(3, 8)):
+    server = StandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        buffer_fname = os.path.join(tmp, "influxdb_buffer.lp")
+        sink = InfluxDBSink({
+                "host"           : "127.0.0.1",
+                "port"           : server.server_address[1],
+                "username"       : "",
+                "password"       : "",
+                "database"       : "benchmark",
+                "batch_size"     : "1000",
+                "flush_interval" : "0.5",
+                "max_points"     : "2000",
+                "buffer_fname"   : buffer_fname,
+            })
+        sink.active.set()
+        sink.start()
+
+        write_times = []
+        counts = {}
+        producers = [threading.Thread(target=lambda n=n: counts.update(
+            {n: produce(sink, "dev" + str(n), rate, duration, write_times)}))
+            for n in range(n_producers)]
+        t_start = time.time()
+        for p in producers:
+            p.start()
+
+        # take the server down for a while
+        max_memory, max_disk = 0, 0
+        while any(p.is_alive() for p in producers):
+            t = time.time() - t_start
+            server.available = not (outage[0] <= t < outage[1])
+            max_memory = max(max_memory, len(sink.points))
+            if os.path.exists(buffer_fname):
+                max_disk = max(max_disk, os.path.getsize(buffer_fname))
+            time.sleep(0.05)
+        server.available = True
+        for p in producers:
+            p.join()
+        t0 = time.time()
+        sink.stop()
+        t_stop = time.time() - t0
+    server.shutdown()
+
+    # check everything arrived, in order
+    received = {}
+    for line in server.lines:
+        name = line.split(",")[0]
+        received.setdefault(name, []).append(int(line.split(" ")[1].split(",")[0][2:-1]))
+    complete = all(received.get("dev" + str(n)) == list(range(counts[n])) for n in range(n_producers))
+
+    write_times.sort()
+    print("points written       {0}".format(sum(counts.values())))
+    print("points received      {0} in {1} requests".format(len(server.lines), server.n_requests))
+    print("complete and ordered {0}".format(complete))
+    print("dropped              {0}".format(sink.n_dropped))
+    print("write() p50 / max    {0:.1f} / {1:.1f} us".format(
+        1e6*write_times[len(write_times)//2], 1e6*write_times[-1]))
+    print("max in memory        {0} points".format(max_memory))
+    print("max on disk          {0:.2f} MB".format(max_disk/1e6))
+    print("stop()               {0:.2f} s".format(t_stop))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark of the networking control path under load: NetworkingDeviceWorkers
+waiting on Device threads.
+
+Runs synthetic slow devices, a pool of NetworkingDeviceWorkers behind a ZeroMQ
+queue (as the NetworkingBroker, but without authentication), and a number of
+clients sending commands to the devices as fast as the replies come back.
+Reports the CPU used by the process, the command round-trip times, and the
+device loop jitter, for the workers waiting on the reply future as they do in
+the program, and (with --spin) for workers that poll for the reply without
+sleeping, as they used to. Run from the repository root, e.g.:
+
+    python benchmarks/networking_workers.py --workers 10 --clients 10
+    python benchmarks/networking_workers.py --workers 10 --clients 10 --spin
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import concurrent.futures
+import zmq
+import numpy as np
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from main import Device, NetworkingDeviceWorker
+
+class SyntheticSlow:
+    def __init__(self, time_offset):
+        self.time_offset = time_offset
+        self.warnings = []
+        self.new_attributes = []
+        self.verification_string = "test"
+        self.shape = (2,)
+        self.dtype = "f8"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def GetWarnings(self):
+        return self.warnings
+
+    def ReadValue(self):
+        return [time.time() - self.time_offset, np.random.random()]
+
+    def GetSetpoint(self):
+        # a serial query, say
+        time.sleep(1e-3)
+        return 1.0
+
+class SpinningWorker(NetworkingDeviceWorker):
+    def wait_for_reply(self, reply, timeout):
+        # how the workers used to wait: checking for the reply in a loop
+        t0 = time.time()
+        while not reply.done():
+            if time.time() - t0 > timeout:
+                raise concurrent.futures.TimeoutError
+        return reply.result()
+
+class HeadlessParent:
+    def __init__(self, devices):
+        self.devices = devices
+
+def device_config(name, rate):
+    return {
+            "name"               : name,
+            "driver_class"       : SyntheticSlow,
+            "constr_params"      : [],
+            "slow_data"          : True,
+            "meta_device"        : False,
+            "double_connect_dev" : False,
+            "plots_queue_maxlen" : 100,
+            "max_NaN_count"      : 10,
+            "telemetry_dt"       : 0,
+            "control_params"     : {
+                "enabled"     : {"value": 2},
+                "HDF_enabled" : {"value": 0},
+                "dt"          : {"value": 1/rate},
+            },
+        }
+
+def client(context, port, dev_names, active, round_trips, n_errors):
+    socket = context.socket(zmq.REQ)
+    socket.connect(f"tcp://127.0.0.1:{port}")
+    i = 0
+    while active.is_set():
+        t0 = time.perf_counter()
+        socket.send_json([dev_names[i % len(dev_names)], "GetSetpoint()"])
+        status, ret_val = socket.recv_json()
+        round_trips.append(time.perf_counter() - t0)
+        if status != "OK":
+            n_errors[0] += 1
+        i += 1
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.close()
+
+def run(args):
+    devices = {"dev" + str(i): Device(device_config("dev" + str(i), args.rate))
+                for i in range(args.devices)}
+    for dev in devices.values():
+        dev.setup_connection(time.time())
+        dev.start()
+    parent = HeadlessParent(devices)
+
+    # the queue between clients and workers, as in the NetworkingBroker
+    context = zmq.Context()
+    frontend = context.socket(zmq.ROUTER)
+    backend = context.socket(zmq.DEALER)
+    frontend_port = frontend.bind_to_random_port("tcp://127.0.0.1")
+    backend_port = backend.bind_to_random_port("tcp://127.0.0.1")
+    threading.Thread(target=zmq.proxy, args=(frontend, backend), daemon=True).start()
+
+    worker_class = SpinningWorker if args.spin else NetworkingDeviceWorker
+    workers = [worker_class(parent, backend_port) for _ in range(args.workers)]
+    for worker in workers:
+        worker.active.set()
+        worker.start()
+
+    round_trips, n_errors = [], [0]
+    active = threading.Event()
+    active.set()
+    clients = [threading.Thread(target=client, args=(context, frontend_port,
+        list(devices), active, round_trips, n_errors)) for _ in range(args.clients)]
+    for c in clients:
+        c.start()
+
+    # measure the CPU used while the clients are sending commands
+    t0, cpu0 = time.time(), time.process_time()
+    time.sleep(args.duration)
+    cpu = (time.process_time() - cpu0) / (time.time() - t0)
+    active.clear()
+    for c in clients:
+        c.join()
+
+    for dev in devices.values():
+        dev.active.clear()
+        dev.wakeup.set()
+    for dev in devices.values():
+        dev.join()
+
+    # the workers block in recv_json() and are daemon threads, so just drop them
+    jitter = [dev.metrics.summary().get("jitter", {}).get("p99_ms", 0) for dev in devices.values()]
+    return {
+            "commands_per_s"       : len(round_trips) / args.duration,
+            "errors"               : n_errors[0],
+            "cpu_cores"            : cpu,
+            "round_trip_p50_ms"    : 1e3*np.percentile(round_trips, 50),
+            "round_trip_p99_ms"    : 1e3*np.percentile(round_trips, 99),
+            "device_jitter_p99_ms" : max(jitter),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--devices", type=int, default=5, help="number of devices")
+    parser.add_argument("--rate", type=float, default=10, help="ReadValue() calls per second per device")
+    parser.add_argument("--workers", type=int, default=10, help="networking workers")
+    parser.add_argument("--clients", type=int, default=10, help="clients sending commands concurrently")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to measure")
+    parser.add_argument("--spin", action="store_true", help="workers poll for the reply instead of blocking")
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=4))
+
+if __name__ == "__main__":
+    main()
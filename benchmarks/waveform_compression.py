@@ -0,0 +1,64 @@
+"""
+Benchmark of compression ratio against throughput for fast-device records.
+
+Compresses simulated PXIe5171 records (int16, channels x samples, a pulse on
+top of digitizer noise) with each method supported by WaveformCompressor,
+with and without shuffle, on one thread and on a pool of threads as used by
+the HDF_writer. Methods that need optional modules (zstd, blosc) are skipped
+if these are not installed. Run from the repository root:
+
+    python benchmarks/waveform_compression.py
+"""
+
+import sys
+import time
+import concurrent.futures
+import numpy as np
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from main import WaveformCompressor
+
+def make_records(n_records=200, n_channels=2, n_samples=2000):
+    t = np.arange(n_samples)
+    records = []
+    for _ in range(n_records):
+        pulse = 3000 * np.exp(-(t - 500)**2 / (2*80**2)) * np.random.uniform(0.5, 1.5)
+        noise = np.random.normal(0, 20, (n_channels, n_samples))
+        records.append((pulse + noise - 1000).astype(np.int16))
+    return records
+
+def run(compressor, records, n_workers):
+    t0 = time.perf_counter()
+    if n_workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as pool:
+            chunks = list(pool.map(compressor.compress, records))
+    else:
+        chunks = [compressor.compress(r) for r in records]
+    dt = time.perf_counter() - t0
+    n_bytes = sum(r.nbytes for r in records)
+    return n_bytes / sum(len(c) for c in chunks), n_bytes / dt / 1e6
+
+def main(n_workers=4):
+    records = make_records()
+    print("{0:8s} {1:>6s} {2:>8s} {3:>7s} {4:>14s} {5:>14s}".format(
+        "method", "level", "shuffle", "ratio", "1 thread [MB/s]",
+        "{0} threads [MB/s]".format(n_workers)))
+    for method, levels in [("gzip", [1, 4, 9]), ("zstd", [1, 3, 9]), ("blosc", [5])]:
+        # check the optional modules are installed
+        try:
+            WaveformCompressor(method)
+        except ValueError as err:
+            print("{0:8s} skipped: {1}".format(method, err))
+            continue
+
+        for level in levels:
+            for shuffle in [False, True]:
+                compressor = WaveformCompressor(method, level, shuffle)
+                ratio, rate_1 = run(compressor, records, 1)
+                ratio, rate_n = run(compressor, records, n_workers)
+                print("{0:8s} {1:6d} {2:>8s} {3:7.2f} {4:14.1f} {5:14.1f}".format(
+                    method, level, str(shuffle), ratio, rate_1, rate_n))
+
+if __name__ == "__main__":
+    main()
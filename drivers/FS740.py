@@ -3,8 +3,6 @@ import datetime as dt
 import functools
 import numpy as np
 import time
-from contextlib import contextmanager
-from influxdb import InfluxDBClient
 import logging
 
 def QueryVisaIOError(func):
@@ -77,7 +75,6 @@ class FS740:
         return warnings
 
     def ReadValue(self):
-        self.WriteValueINFLUXDB()
         tint = self.TBaseTInterval(True)
         try:
             tint = float(tint)
@@ -153,30 +150,26 @@ class FS740:
             lst.append(l[i:i+n])
         return lst
 
-    def WriteValueINFLUXDB(self):
+    def ReadTelemetry(self):
         """
-        I've now hardcoded in the influxdb part because I already made a
-        database in a different way than Jakob has it setup for the general
-        acquisition software.
-        Should transition over at some point.
+        GPS and timebase status, satellite tracking, and the timebase event
+        log, as (measurement, tags, fields, time in ms) points for InfluxDB.
+        Called by the program on its own schedule (telemetry_dt in the .ini
+        file) rather than with every ReadValue(), and written through the
+        program's InfluxDB connection.
         """
-        @contextmanager
-        def get_connection(*args, **kwargs):
-            connection = InfluxDBClient(*args, **kwargs)
-            try:
-                yield connection
-            finally:
-                connection.close()
-
-        try:
+        tableO, tableS, tableL = 'overview', 'satellites', 'log'
 
-            tableO, tableS, tableL = 'overview', 'satellites', 'log'
+        def time_ms(timestamp):
+            # instrument (UTC) time to milliseconds since the epoch
+            return 1000 * timestamp.replace(tzinfo = dt.timezone.utc).timestamp()
 
+        try:
             values, descs = self.ReadValueINFLUXDB(full_output = True)
 
             s = values[1].split('.')
-            time = dt.datetime.strptime(values[0]+' '+s[0]+'.'+s[1][:6],
-                                        '%Y,%m,%d %H,%M,%S.%f').isoformat()
+            time = time_ms(dt.datetime.strptime(values[0]+' '+s[0]+'.'+s[1][:6],
+                                                '%Y,%m,%d %H,%M,%S.%f'))
 
             values, descs = self.ExpandValue(values, descs, 'GPSMode',
                                              (bool, float, float), ('antiJamming',
@@ -189,15 +182,15 @@ class FS740:
                 idx = descs.index('GPSSatelliteTrackingStatus')
                 sats = self.chunks(values[idx].split(','), 8)
             except Exception as e:
-                logging.warning("FS740 warning in WriteValueINFLUXDB GPSSatelliteTrackingStatus: {0}".format(e))
-                return
+                logging.warning("FS740 warning in ReadTelemetry GPSSatelliteTrackingStatus: {0}".format(e))
+                return []
             try:
                 ids, signal, elevation, azimuth = \
                 zip(*[(int(val[0]), int(val[4]), int(val[5]), int(val[6]))
                       for val in sats if (val[3] =='0') and (val[0] != '0')])
             except Exception as e:
-                logging.warning("FS740 warning in WriteValueINFLUXDB GPSSatelliteTrackingStatus: {0}; {1}".format(sats, e))
-                return
+                logging.warning("FS740 warning in ReadTelemetry GPSSatelliteTrackingStatus: {0}; {1}".format(sats, e))
+                return []
             values = values[2:-2]
             descs = descs[2:-2]
             values.append(len(ids))
@@ -205,39 +198,24 @@ class FS740:
             values.append(round(sum(signal)/len(signal),1))
             descs.append('SNR')
 
-            writeO = {"measurement":tableO,
-                     "tags": {'clock_id':'FS740'},
-                     "time":time,
-                     "fields":dict((key,value) for key,value in
-                                   zip(descs,values))}
-
-            writeS = [{"measurement":tableS,
-                      "tags":{'satelliteID':id},
-                      "time":time,
-                      "fields":{"signal":sig,
-                                "elevation":ele,
-                                "azimuth":azi}} for id, sig, ele, azi in \
-                      zip(ids, signal, elevation, azimuth)]
-
-            writeL = []
+            points = [(tableO, {'clock_id':'FS740'}, dict(zip(descs, values)), time)]
+
+            points += [(tableS, {'satelliteID':id},
+                        {"signal":sig, "elevation":ele, "azimuth":azi}, time)
+                       for id, sig, ele, azi in zip(ids, signal, elevation, azimuth)]
+
             while int(self.TBaseEventCount()) > 0:
                 event = self.TBaseEventNext().split(',')
                 msg = event[0]
                 ts = ','.join(event[1:])
-                ts = dt.datetime.strptime(ts,"%Y,%m,%d,%H,%M,%S").isoformat()
-                writeL.append({"measurement":tableL,
-                               "tags":{"deviceID":'FS740', "label":"event"},
-                               "time":ts, "fields":{"message":msg}})
-            with get_connection(host = '172.28.82.114', port = 8086,
-                                database = 'clock', username = 'test', \
-                                password = 'test') as connection:
-                connection.write_points([writeO])
-                connection.write_points(writeS)
-                if len(writeL) > 0:
-                    connection.write_points(writeL)
+                ts = time_ms(dt.datetime.strptime(ts,"%Y,%m,%d,%H,%M,%S"))
+                points.append((tableL, {"deviceID":'FS740', "label":"event"},
+                               {"message":msg}, ts))
+            return points
         except Exception as e:
-            logging.warning("FS740 warning in WriteValueINFLUXDB: {0}".format(e))
-            return
+            logging.warning("FS740 warning in ReadTelemetry: {0}".format(e))
+            return []
+
     def VerifyOperation(self):
         return self.QueryIDN().split(',')[1]
 
@@ -33,7 +33,8 @@ def NetworkingClassDecorator(cls):
     # don't wrap methods with this name
     ignore = ['__init__', '__enter__', '__exit__', 'OpenConnection',
             'CloseConnection', 'ExecuteNetworkCommand', 'ReadValue', 'Decode',
-            'GetWarnings']
+            'DecodeWaveforms', 'DecodeFrames', 'RequestSnapshot', 'GetWarnings',
+            'GetDeviceMetrics', 'SendRequest', 'ExecuteBatch']
     for attr_name in dir(cls):
         attr_value = getattr(cls, attr_name)
         if isinstance(attr_value, FunctionType):
@@ -57,6 +58,16 @@ class ReadValueThread(threading.Thread):
         self.active = threading.Event()
         self.finished = False
 
+        # whether a published value has been received, in which case the
+        # snapshot (if it arrives later) is out of date
+        self.lock = threading.Lock()
+        self.received = False
+
+    def offer_snapshot(self, value):
+        with self.lock:
+            if not self.received:
+                self.value = value
+
     def run(self):
         """
         Keep listening on the readout port for new messages from the
@@ -68,10 +79,13 @@ class ReadValueThread(threading.Thread):
             # upon stopping the program before the while loop reaches the
             # cleared thread event active
             try:
-                data = self.parent.socket_readout.recv_string()
-                retval = self.parent.Decode(data)
-                retval[0] -= self.parent.time_offset
-                self.value = retval
+                # slow data arrives as a single json string, fast data as a
+                # multipart message (topic, header, waveforms buffer)
+                frames = self.parent.socket_readout.recv_multipart(copy=False)
+                retval = self.parent.DecodeFrames(frames)
+                with self.lock:
+                    self.received = True
+                    self.value = retval
                 # need a sleep to release to other threads
                 time.sleep(1e-4)
             except zmq.error.ContextTerminated:
@@ -113,6 +127,7 @@ def NetworkingClient(time_offset, driver, connection, *args):
             self.server = connection['server']
             self.port_readout = connection['port_readout']
             self.port_control = connection['port_control']
+            self.port_snapshot = connection.get('port_snapshot')
             self.publisher = connection['publisher_name']
             self.device_name = connection['device_name']
 
@@ -128,6 +143,11 @@ def NetworkingClient(time_offset, driver, connection, *args):
             self.readvalue_thread.active.set()
             self.readvalue_thread.start()
 
+            # start with the last published value, rather than NaN until the
+            # next publish (the subscription is already buffering updates)
+            if self.port_snapshot:
+                self.RequestSnapshot()
+
             self.verification_string = self.ExecuteNetworkCommand('verification_string')
 
             self.dtype = self.ExecuteNetworkCommand('dtype')
@@ -202,32 +222,126 @@ def NetworkingClient(time_offset, driver, connection, *args):
             retval = json.loads(dat)
             return retval
 
-        def ExecuteNetworkCommand(self, command):
-            # send command to the server hosting the device
-            self.socket_control.send_json([self.device_name, command])
+        def DecodeFrames(self, frames):
+            """
+            Function decodes a message from the publisher: slow data is a
+            single json string, fast data a multipart message (topic, header,
+            waveforms buffer)
+            """
+            if len(frames) == 1:
+                retval = self.Decode(frames[0].bytes.decode())
+                retval[0] -= self.time_offset
+                return retval
+            return self.DecodeWaveforms(frames)
+
+        def RequestSnapshot(self):
+            """
+            Request the last value published by the server for this device from
+            its snapshot port, for the first ReadValue() (unless an update
+            arrives first)
+            """
+            socket = self.context.socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.connect(f"tcp://{self.server}:{self.port_snapshot}")
+            try:
+                socket.send_string(self.topicfilter)
+                if (socket.poll(self.timeout) & zmq.POLLIN) == 0:
+                    logging.warning(f"{self.device_name} networking warning in " +
+                                    "RequestSnapshot : no response from server")
+                    return
+                frames = socket.recv_multipart(copy=False)
+                # nothing published yet
+                if len(frames) == 1 and not frames[0].bytes:
+                    return
+                self.readvalue_thread.offer_snapshot(self.DecodeFrames(frames))
+            finally:
+                socket.close()
+
+        def DecodeWaveforms(self, frames):
+            """
+            Function decodes a multipart message of fast data from the publisher
+            into [waveforms, attrs], as returned by ReadValue() of the device on
+            the server. The waveforms are a (read-only) view of the received
+            buffer, and the timestamps in the attrs are shifted to the local
+            time_offset
+            """
+            topic, header, buf = frames
+            header = json.loads(header.bytes)
+            waveforms = np.frombuffer(buf.buffer, dtype=header["dtype"]).reshape(header["shape"])
+            shift = header["time_offset"] - self.time_offset
+            attrs = header["attrs"]
+            for record_attrs in attrs:
+                for key in record_attrs:
+                    if key.endswith("timestamp"):
+                        record_attrs[key] += shift
+            return [waveforms, attrs]
+
+        def SendRequest(self, request):
+            # send request to the server hosting the device
+            self.socket_control.send_json(request)
 
             # need the timeout because REP-REQ will wait indefinitely for a
             # reply, need to handle when a server stops or a message isn't
             # received for some other reason
             if (self.socket_control.poll(self.timeout) & zmq.POLLIN) != 0:
-                status, retval = self.socket_control.recv_json()
-                if status == "OK":
-                    return retval
-                else:
-                    logging.warning(f"{self.device_name} networking warning in " +
-                    f"ExecuteNetworkCommand : error for {command} -> {retval}")
-                    return np.nan
+                return self.socket_control.recv_json()
 
             # error handling if no reply received withing timeout
             logging.warning(f"{self.device_name} networking warning in " +
-                        +"ExecuteNetworkCommand : no response from server")
-            warning_dict = {f"message" : "ExecuteNetworkCommand for {device_name}: no response from server"}
+                        "SendRequest : no response from server")
+            warning_dict = {"message" : f"SendRequest for {self.device_name}: no response from server"}
             self.warnings.append([time.time(), warning_dict])
             self.socket_control.setsockopt(zmq.LINGER, 0)
             self.socket_control.close()
             self.socket_control = self.context.socket(zmq.REQ)
             self.socket_control.connect(f"tcp://{self.server}:{self.port_control}")
-            return np.nan
+            return None
+
+        def ExecuteNetworkCommand(self, command):
+            reply = self.SendRequest([self.device_name, command])
+            if reply is None:
+                return np.nan
+            status, retval = reply
+            if status == "OK":
+                return retval
+            else:
+                logging.warning(f"{self.device_name} networking warning in " +
+                f"ExecuteNetworkCommand : error for {command} -> {retval}")
+                return np.nan
+
+        def ExecuteBatch(self, commands):
+            """
+            Execute a list of commands in one round trip, and return the list
+            of their return values (NaN for those that failed). Commands given
+            as strings are for this device, and are executed in order in one
+            pass of its main loop; commands can also be given as (device name,
+            command) pairs, for other devices on the same server
+            """
+            if all(isinstance(c, str) for c in commands):
+                request = [self.device_name, list(commands)]
+            else:
+                request = [[self.device_name, c] if isinstance(c, str) else list(c)
+                            for c in commands]
+            reply = self.SendRequest(request)
+            if reply is None:
+                return [np.nan] * len(commands)
+            status, retvals = reply
+            if status != "OK":
+                logging.warning(f"{self.device_name} networking warning in " +
+                f"ExecuteBatch : error for {commands} -> {retvals}")
+                return [np.nan] * len(commands)
+            results = []
+            for command, (status, retval) in zip(commands, retvals):
+                if status != "OK":
+                    logging.warning(f"{self.device_name} networking warning in " +
+                    f"ExecuteBatch : error for {command} -> {retval}")
+                    retval = np.nan
+                results.append(retval)
+            return results
+
+        def GetDeviceMetrics(self):
+            # timing metrics of the device on the server side
+            return self.ExecuteNetworkCommand("GetDeviceMetrics()")
 
         def ReadValue(self):
             if self.readvalue_thread.value:
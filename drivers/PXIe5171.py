@@ -10,6 +10,10 @@ import datetime
 import logging
 
 class PXIe5171:
+    # blocking waveform fetches: keep a dedicated thread even when devices
+    # share a worker pool (see device_pool_workers in settings.ini)
+    dedicated_thread = True
+
     def __init__(self, time_offset, COM_port, record, sample, trigger, edge, channels):
         try:
             self.session = niscope.Session(COM_port)
@@ -178,6 +182,8 @@ class PXIe5171:
                     attrs.update(attrs_upd)
             all_attrs.append(attrs)
 
+        # a view of the buffer, whose (records, channels, samples) layout is that
+        # of the extendable HDF dataset, so the records are written without copies
         return [waveforms_flat.reshape(self.shape), all_attrs]
 
     def GetWarnings(self):
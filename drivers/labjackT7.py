@@ -67,6 +67,10 @@ class VoltageRamp(StoppableThread):
         self.driver.ramp_thread = None
 
 class labjackT7:
+    # eStreamRead() blocks until the stream buffer is full, so keep a
+    # dedicated thread rather than holding up a pool worker
+    dedicated_thread = True
+
     def __init__(self, time_offset, IP_address, sampling, channels):
         self.hv1_enable = 0
         self.hv2_enable = 0
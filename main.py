@@ -1,6 +1,11 @@
 ﻿import re
+import ast
+import math
 import zmq
 import uuid
+import zlib
+import mmap
+import struct
 import h5py
 import time
 import json
@@ -14,6 +19,8 @@ import itertools
 import traceback
 import threading
 import numpy as np
+import contextlib
+import concurrent.futures
 import configparser
 import datetime as dt
 import wmi, pythoncom
@@ -25,9 +32,24 @@ import scipy.signal as signal
 from collections import deque
 import sys, os, glob, importlib
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
 from rich.logging import RichHandler
 from zmq.auth.thread import ThreadAuthenticator
 
+# optional compression codecs for waveform data
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
 # fancy colors and formatting for logging
 FORMAT = "%(message)s"
 logging.basicConfig(
@@ -138,6 +160,152 @@ def update_QComboBox(cbx, options, value):
 def split(string, separator=","):
     return [x.strip() for x in string.split(separator)]
 
+def is_enabled(value):
+    # settings read from settings.ini are strings, while those set from a
+    # QCheckBox are its check state (0 or 2)
+    return value in [1, 2, "1", "2", "True"]
+
+# HDF files held open by an HDF_writer in SWMR mode (filename -> run name), and
+# the persistent SWMR reader handles attached to them (filename -> (run, file))
+swmr_files = {}
+swmr_readers = {}
+swmr_lock = threading.RLock()
+
+def rows_to_structured_array(rows, dtype, name=""):
+    """Convert a list of rows (sequences of column values) to an array of the
+    given structured dtype.
+
+    Rows that are too short or contain None are padded with NaN (zero for
+    non-float columns); rows that cannot be converted at all are dropped with
+    an error message.
+    """
+    # fast path: all rows complete and well-formed
+    try:
+        return np.array([tuple(row) for row in rows], dtype=dtype)
+    except (ValueError, TypeError):
+        pass
+
+    # slow path: convert row by row
+    n_cols = len(dtype.names)
+    fill = [np.nan if dtype[i].kind in "fc" else np.zeros((), dtype[i])[()] for i in range(n_cols)]
+    arr = np.empty(len(rows), dtype=dtype)
+    n = 0
+    for row in rows:
+        try:
+            row = list(row)
+            if len(row) > n_cols:
+                raise ValueError("row has {0} columns, expected {1}".format(len(row), n_cols))
+            row += [None] * (n_cols - len(row))
+            arr[n] = tuple(fill[i] if x is None else x for i, x in enumerate(row))
+            n += 1
+        except (ValueError, TypeError) as err:
+            logging.error("Error in rows_to_structured_array(): {0}; {1}".format(name, err))
+    return arr[:n]
+
+def chunk_shape(row_shape, dtype, dt, target_bytes=10**6, max_span=3600):
+    """Chunk shape for a dataset extended by rows of the given shape and type,
+    one every dt seconds: about target_bytes per chunk, but no more rows than
+    are acquired in max_span seconds, so that slow devices don't leave mostly
+    empty chunks (which HDF5 allocates in full) at the end of a short run."""
+    row_bytes = max(np.dtype(dtype).itemsize * int(np.prod(row_shape)), 1)
+    rows = max(target_bytes // row_bytes, 1)
+    if dt > 0:
+        rows = min(rows, max(int(max_span / dt), 1))
+    return (int(rows),) + tuple(row_shape)
+
+@contextlib.contextmanager
+def open_hdf_for_reading(fname):
+    """Open an HDF file read-only.
+
+    While an HDF_writer holds the file open in SWMR mode, the file can only be
+    read in SWMR mode; instead of reopening it each time, one reader handle is
+    kept open for the duration of the run. Readers should call refresh() on
+    datasets (see refresh_dataset()) to see newly appended data.
+    """
+    with swmr_lock:
+        run = swmr_files.get(fname)
+        if run is None:
+            close_swmr_reader(fname)
+            with h5py.File(fname, 'r') as f:
+                yield f
+            return
+
+        # (re)attach if there's no reader yet, or it was opened for a previous run
+        reader = swmr_readers.get(fname)
+        if reader and reader[0] != run:
+            close_swmr_reader(fname)
+            reader = None
+        if reader is None:
+            reader = (run, h5py.File(fname, 'r', libver='latest', swmr=True))
+            swmr_readers[fname] = reader
+        yield reader[1]
+
+def close_swmr_reader(fname):
+    with swmr_lock:
+        reader = swmr_readers.pop(fname, None)
+        if reader:
+            reader[1].close()
+
+def read_fast_traces(grp, name, n=1):
+    """The last n traces of a fast device as (samples, channels) arrays, and
+    their attributes as dicts, newest first, from either HDF layout: one
+    extendable (records, channels, samples) dataset with a name_attrs table,
+    or one (samples, channels) dataset per trace (name_0, name_1, ...) listed
+    in a name_index table (or, in older files, found by counting the group)."""
+    if isinstance(grp.get(name), h5py.Dataset):
+        dset = refresh_dataset(grp[name])
+        n_records = dset.shape[0]
+        traces = [trace.T for trace in dset[max(n_records-n, 0):n_records][::-1]]
+        attrs_dset = refresh_dataset(grp[name + "_attrs"])
+        n_attrs = attrs_dset.shape[0]
+        attrs = [json.loads(row["attrs"]) for row in attrs_dset[max(n_attrs-n, 0):n_attrs][::-1]]
+        return traces, attrs
+
+    # one dataset per trace, referenced from the index
+    traces, attrs = [], []
+    if isinstance(grp.get(name + "_index"), h5py.Dataset):
+        index = refresh_dataset(grp[name + "_index"])
+        n_records = index.shape[0]
+        for row in index[max(n_records-n, 0):n_records][::-1]:
+            dset = grp.file[row["dataset"]]
+            traces.append(dset[()])
+            attrs.append(dict(dset.attrs))
+        return traces, attrs
+
+    # files without an index: datasets numbered by the group size at the time of writing
+    rec_num = len(grp) - 1
+    for i in range(n):
+        try:
+            dset = grp[name + "_" + str(rec_num-i)]
+        except KeyError:
+            break
+        traces.append(dset[()])
+        attrs.append(dict(dset.attrs))
+    return traces, attrs
+
+def to_json(obj):
+    # for json.dumps(): numpy scalars and arrays to plain Python objects
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    return str(obj)
+
+def record_timestamp(attrs):
+    # the timestamp of a fast-device record, from its attributes; drivers give
+    # it either as "timestamp" or per channel (e.g. "ch0 : timestamp")
+    for key, val in attrs.items():
+        if key.split(":")[-1].strip() == "timestamp":
+            try:
+                return float(val)
+            except (TypeError, ValueError):
+                return np.nan
+    return np.nan
+
+def refresh_dataset(dset):
+    # in SWMR mode, dataset metadata (e.g. shape) has to be reloaded explicitly
+    if dset.file.swmr_mode:
+        dset.refresh()
+    return dset
+
 class FlexibleGridLayout(qt.QHBoxLayout):
     """A QHBoxLayout of QVBoxLayouts."""
     def __init__(self):
@@ -186,6 +354,252 @@ class FlexibleGridLayout(qt.QHBoxLayout):
 ##########################################################################
 ##########################################################################
 
+class DeviceWakeup:
+    """Wakes up a Device thread, remembering when the wakeup was requested."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.time_requested = None
+
+        # called on set(), e.g. to notify the DeviceScheduler
+        self.callback = None
+
+    def set(self):
+        if not self.event.is_set():
+            self.time_requested = time.time()
+        self.event.set()
+        if self.callback:
+            self.callback()
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def wait(self, timeout):
+        return self.event.wait(timeout)
+
+    def clear(self):
+        """Clear the wakeup and return the time it was requested (or None)."""
+        time_requested = self.time_requested
+        self.time_requested = None
+        self.event.clear()
+        return time_requested
+
+class CommandQueue(deque):
+    """A deque of commands that wakes up the Device thread on append()."""
+    def __init__(self, wakeup):
+        super().__init__()
+        self.wakeup = wakeup
+
+    def append(self, cmd):
+        super().append(cmd)
+        self.wakeup.set()
+
+class CommandSet(set):
+    """A set of commands that wakes up the Device thread on add()."""
+    def __init__(self, wakeup):
+        super().__init__()
+        self.wakeup = wakeup
+
+    def add(self, cmd):
+        super().add(cmd)
+        self.wakeup.set()
+
+class PublishChannel:
+    """Rows of data pushed by the Device threads for the Networking thread to
+    publish, as (device name, data, time pushed); get() blocks until there are
+    any."""
+    def __init__(self):
+        self.queue = deque()
+        self.event = threading.Event()
+
+    def push(self, dev_name, data):
+        # timestamp the row here, in the device thread right after the read,
+        # rather than when the Networking thread gets round to publishing it
+        self.queue.append((dev_name, data, time.time()))
+        self.event.set()
+
+    def get(self, timeout):
+        """Wait for at most timeout seconds, and return all rows pushed so far."""
+        self.event.wait(timeout)
+        self.event.clear()
+        rows = []
+        while self.queue:
+            rows.append(self.queue.popleft())
+        return rows
+
+class CommandDispatcher:
+    """Calls driver commands given as strings, e.g. "SetFrequency(100e6)".
+
+    Each distinct command string is parsed only once. A call of a driver
+    method with constant arguments is cached as the bound method and its
+    arguments and then called directly; any other command is cached as
+    compiled code and evaluated as "device." + command, like before.
+    """
+    def __init__(self, device, maxsize=1000):
+        self.device = device
+        self.maxsize = maxsize
+        self.cache = {}
+
+    def __call__(self, cmd):
+        try:
+            method, args, kwargs, code = self.cache[cmd]
+        except KeyError:
+            method, args, kwargs, code = self.parse(cmd)
+            # sequencer scans generate many distinct commands; don't let the cache grow forever
+            if len(self.cache) >= self.maxsize:
+                self.cache.clear()
+            self.cache[cmd] = (method, args, kwargs, code)
+
+        if method:
+            return method(*args, **kwargs)
+        else:
+            return eval(code, globals(), {"device": self.device})
+
+    def parse(self, cmd):
+        # the fallback: compiled code equivalent to eval("device." + cmd)
+        code = compile("device." + cmd.strip(), "<command>", "eval")
+
+        # check for a direct method call, e.g. SetFrequency(100e6)
+        expr = ast.parse(cmd.strip(), mode="eval").body
+        if not (isinstance(expr, ast.Call) and isinstance(expr.func, ast.Name)):
+            return None, None, None, code
+        try:
+            args = tuple(ast.literal_eval(arg) for arg in expr.args)
+            kwargs = {kw.arg: ast.literal_eval(kw.value) for kw in expr.keywords}
+        except ValueError:
+            return None, None, None, code
+        if None in kwargs:
+            return None, None, None, code
+
+        # mutable arguments (lists, dicts) must be re-created for every call
+        if not all(self.is_immutable(x) for x in args + tuple(kwargs.values())):
+            return None, None, None, code
+
+        return getattr(self.device, expr.func.id), args, kwargs, None
+
+    def is_immutable(self, x):
+        if isinstance(x, tuple):
+            return all(self.is_immutable(y) for y in x)
+        return isinstance(x, (int, float, complex, str, bytes, bool, type(None)))
+
+class TimingHistogram:
+    """Count, total, maximum, and a histogram with power-of-two bins of
+    durations in seconds."""
+    # bin i holds durations in [2**(i-21), 2**(i-20)) s, i.e. from ~1 us up
+    # to 8 s; shorter and longer durations go into the first and last bins
+    n_bins = 24
+    bin_offset = 20
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bins = [0] * self.n_bins
+
+    def add(self, t):
+        self.count += 1
+        self.total += t
+        if t > self.max:
+            self.max = t
+        # frexp() returns the binary exponent, i.e. floor(log2(t)) + 1
+        i = math.frexp(t)[1] + self.bin_offset if t > 0 else 0
+        self.bins[min(max(i, 0), self.n_bins-1)] += 1
+
+    def upper_edge(self, i):
+        return 2.0**(i - self.bin_offset)
+
+    def percentile(self, q):
+        # upper edge of the bin containing the q-th percentile
+        n = 0
+        for i, count in enumerate(self.bins):
+            n += count
+            if n >= q/100 * self.count:
+                return min(self.upper_edge(i), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+                "count"   : self.count,
+                "mean_ms" : 1e3*self.total/self.count if self.count else 0,
+                "p50_ms"  : 1e3*self.percentile(50),
+                "p99_ms"  : 1e3*self.percentile(99),
+                "max_ms"  : 1e3*self.max,
+                "histogram_ms" : {"<{0:g}".format(1e3*self.upper_edge(i)) : count
+                    for i, count in enumerate(self.bins) if count},
+            }
+
+class DeviceMetrics:
+    """Timing histograms of the calls made in a Device main loop, keyed by
+    driver method name (e.g. "ReadValue", "GetWarnings", "SetFrequency"),
+    plus the loop jitter and wake latency. Recording is a few arithmetic
+    operations, so it is always on."""
+    def __init__(self):
+        self.time_started = time.time()
+        self.timings = {}
+
+    def record(self, name, t):
+        hist = self.timings.get(name)
+        if hist is None:
+            hist = self.timings[name] = TimingHistogram()
+        hist.add(t)
+
+    def summary(self):
+        # copy the dict since the device thread may add to it meanwhile
+        return {name: hist.summary() for name, hist in dict(self.timings).items()}
+
+class LatestState:
+    """The latest data row, event and monitoring command returns of a device,
+    as published by the device thread. Each value carries a version number, so
+    that the Monitoring only has to re-render what changed since it last
+    looked."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.version = 0
+
+    def publish(self, key, value, if_changed=False):
+        with self.lock:
+            # for (scalar) values that are mostly the same each time, e.g.
+            # monitoring returns, only bump the version when they change
+            if if_changed and key in self.values and self.values[key][1] == value:
+                return
+            self.version += 1
+            self.values[key] = (self.version, value)
+
+    def changed(self, seen):
+        """Return a dict of the values published since the versions recorded in
+        seen (a dict kept by the caller), and update seen."""
+        with self.lock:
+            items = list(self.values.items())
+        changed = {}
+        for key, (version, value) in items:
+            if seen.get(key) != version:
+                seen[key] = version
+                changed[key] = value
+        return changed
+
+class IndicatorScheduler:
+    """Decides which monitoring commands of a device's indicator controls are
+    due. Indicators sharing a command are served by one call, made at the
+    shortest of their poll_interval (0, the default, meaning every pass of
+    the Monitoring loop)."""
+    def __init__(self, dev):
+        # the names of the indicator controls, and the poll interval, by command
+        self.indicators = {}
+        self.intervals = {}
+        for c_name, params in dev.config["control_params"].items():
+            if params.get("type") in ["indicator", "indicator_button", "indicator_lineedit"]:
+                c = params["monitoring_command"]
+                self.indicators.setdefault(c, []).append(c_name)
+                self.intervals[c] = min(self.intervals.get(c, np.inf), params.get("poll_interval", 0))
+        self.time_last_polled = dict.fromkeys(self.intervals, 0)
+
+    def due(self):
+        t = time.time()
+        due = [c for c, dt in self.intervals.items() if t - self.time_last_polled[c] >= dt]
+        for c in due:
+            self.time_last_polled[c] = t
+        return due
+
 class Device(threading.Thread):
     def __init__(self, config):
         threading.Thread.__init__(self)
@@ -200,26 +614,51 @@ class Device(threading.Thread):
         self.operational = False
         self.error_message = ""
 
+        # the main loop sleeps until a command is queued or ReadValue() is due
+        self.wakeup = DeviceWakeup()
+        self.max_idle_wait = 1.0
+
+        # latencies between requesting a wakeup and dispatching to the driver
+        self.wake_latency = deque(maxlen=100)
+
+        # timing of the driver calls in the main loop
+        self.metrics = DeviceMetrics()
+        self.read_count = 0
+
         # for commands sent to the device
-        self.commands = []
+        self.commands = CommandQueue(self.wakeup)
         self.last_event = []
-        self.monitoring_commands = set()
-        self.sequencer_commands = []
-        self.networking_commands = []
+        self.monitoring_commands = CommandSet(self.wakeup)
+        self.sequencer_commands = CommandQueue(self.wakeup)
+        self.networking_commands = CommandQueue(self.wakeup)
 
         # for warnings about device abnormal condition
         self.warnings = []
 
-        # the data and events queues
+        # the last data row, event and monitoring returns, for the Monitoring
+        self.latest = LatestState()
+
+        # the InfluxDB sink for the driver's telemetry (if any), see read_telemetry()
+        self.influxdb_sink = None
+        self.time_last_telemetry = 0
+
+        # the data and events queues, the HDF writer's journal (if any), and the
+        # Networking publisher's channel (if any)
+        self.journal = None
+        self.publish_channel = None
         self.time_last_read = 0
         self.data_queue = deque()
         self.config["plots_queue"] = deque(maxlen=self.config["plots_queue_maxlen"])
         self.events_queue = deque()
-        self.monitoring_events_queue = deque()
         self.sequencer_events_queue = deque()
-        # use a dictionary for the networking queue to allow use of .get() to
-        # allow for unique ids if multiple network clients are connected
-        self.networking_events_queue = {}
+
+        # the driver instance, while the main loop is running
+        self.driver = None
+
+        # when to run the next step of the main loop (for the DeviceScheduler),
+        # and the CPU time spent in the main loop
+        self.next_step_time = 0
+        self.cpu_time = 0
 
         # the variable for counting the number of NaN returns
         self.nan_count = 0
@@ -286,140 +725,603 @@ class Device(threading.Thread):
         self.data_queue.clear()
         self.events_queue.clear()
 
-    def run(self):
+    def read_due(self, dt):
+        return time.time() - self.time_last_read >= dt
+
+    def time_to_next_wakeup(self, dt):
+        # idle devices still wake up occasionally to notice changed settings
+        if self.config["control_params"]["enabled"]["value"] < 2:
+            return self.max_idle_wait
+        next_read = self.time_last_read + dt - time.time()
+        return min(max(next_read, 0), self.max_idle_wait)
+
+    def get_dt(self):
+        # get and sanity check loop delay
+        try:
+            dt = float(self.config["control_params"]["dt"]["value"])
+            if dt < 0.002:
+                logging.warning("Device dt too small.")
+                raise ValueError
+        except ValueError:
+            logging.info(traceback.format_exc())
+            dt = 0.1
+        return dt
+
+    def activate(self):
         # check connection to the device was successful
         if not self.operational:
+            return False
+        self.active.set()
+        self.control_started = True
+        return True
+
+    def open_driver(self):
+        self.exit_stack = contextlib.ExitStack()
+        self.driver = self.exit_stack.enter_context(
+                self.config["driver_class"](*self.constr_params)
+            )
+        self.dispatch = CommandDispatcher(self.driver)
+
+    def close_driver(self):
+        if self.driver is not None:
+            self.driver = None
+            self.exit_stack.close()
+
+    def report_exception(self):
+        logging.info(traceback.format_exc())
+        err_msg = traceback.format_exc()
+        warning_dict = {
+                "message" : "exception in " + self.config["name"] + ": "+err_msg,
+                "exception" : 1,
+            }
+        self.warnings.append([time.time(), warning_dict])
+
+    def run(self):
+        if not self.activate():
             return
-        else:
-            self.active.set()
-            self.control_started = True
 
         # main control loop
         try:
-            with self.config["driver_class"](*self.constr_params) as device:
+            self.open_driver()
+            try:
                 while self.active.is_set():
-                    # get and sanity check loop delay
+                    # sleep until a command is queued or the next ReadValue() is due
+                    self.wakeup.wait(self.time_to_next_wakeup(self.get_dt()))
+                    self.step()
+            finally:
+                self.close_driver()
+
+        # report any exception that has occurred in the run() function
+        except Exception as err:
+            self.report_exception()
+
+    def step(self):
+        """A single pass of the main loop: send queued commands, and call
+        ReadValue() if it is due."""
+        thread_time = time.thread_time()
+        try:
+            self.dispatch_all(self.get_dt())
+        finally:
+            self.cpu_time += time.thread_time() - thread_time
+
+    def dispatch_all(self, dt):
+        time_requested = self.wakeup.clear()
+
+        # level 1: check device is enabled for sending commands
+        if self.config["control_params"]["enabled"]["value"] < 1:
+            return
+
+        # record how long it took from the wakeup request to dispatch
+        if time_requested is None and self.read_due(dt):
+            time_requested = self.time_last_read + dt
+        if time_requested is not None:
+            latency = max(time.time() - time_requested, 0)
+            self.wake_latency.append(latency)
+            self.metrics.record("wake latency", latency)
+
+        # check device for abnormal conditions
+        t0 = time.perf_counter()
+        warning = self.driver.GetWarnings()
+        self.metrics.record("GetWarnings", time.perf_counter() - t0)
+        if warning:
+            self.warnings += warning
+
+        # send control commands, if any, to the device, and record return values
+        while self.commands:
+            c = self.commands.popleft()
+            try:
+                ret_val = self.timed_dispatch(c)
+            except Exception as err:
+                logging.warning(traceback.format_exc())
+                ret_val = str(err)
+            if (c == "ReadValue()") and ret_val:
+                self.push_data(ret_val)
+            ret_val = "None" if not ret_val else ret_val
+            self.last_event = [ time.time()-self.time_offset, c, ret_val ]
+            self.push_event(self.last_event)
+
+        # send sequencer commands, if any, to the device, and record return values
+        while self.sequencer_commands:
+            id0, c = self.sequencer_commands.popleft()
+            try:
+                ret_val = self.timed_dispatch(c)
+            except Exception as err:
+                logging.warning(traceback.format_exc())
+                ret_val = None
+            if (c == "ReadValue()") and ret_val:
+                self.push_data(ret_val)
+            self.sequencer_events_queue.append([id0, time.time_ns(), c, ret_val])
+
+        # send monitoring commands, if any, to the device, and record return values
+        # copy set and clear before iterating to prevent an error when adding to
+        # monitoring commands while iterating over them
+        mc = self.monitoring_commands.copy()
+        self.monitoring_commands.clear()
+        for c in mc:
+            try:
+                ret_val = self.timed_dispatch(c)
+            except Exception as err:
+                logging.info(traceback.format_exc())
+                ret_val = str(err)
+            ret_val = "None" if not ret_val else ret_val
+            self.latest.publish(("monitoring", c), ret_val, if_changed=True)
+
+        # send networking commands, if any, to the device, and hand the return
+        # values to the waiting NetworkingDeviceWorkers
+        while self.networking_commands:
+            reply, cmd = self.networking_commands.popleft()
+            # skip commands the worker has stopped waiting for
+            if not reply.set_running_or_notify_cancel():
+                continue
+            # a batch: executed in order, returning [status, return value] of each
+            if isinstance(cmd, list):
+                ret_vals = []
+                for c in cmd:
                     try:
-                        dt = float(self.config["control_params"]["dt"]["value"])
-                        if dt < 0.002:
-                            logging.warning("Device dt too small.")
-                            raise ValueError
-                    except ValueError:
+                        ret_vals.append(["OK", self.timed_dispatch(c)])
+                    except Exception as err:
                         logging.info(traceback.format_exc())
-                        dt = 0.1
+                        ret_vals.append(["ERROR", str(err)])
+                reply.set_result(ret_vals)
+                continue
+            try:
+                ret_val = self.timed_dispatch(cmd)
+            except Exception as err:
+                logging.info(traceback.format_exc())
+                ret_val = str(err)
+            reply.set_result(ret_val)
 
-                    # 50 Hz loop delay
-                    time.sleep(0.02)
+        # level 2: check device is enabled for regular ReadValue
+        if self.config["control_params"]["enabled"]["value"] < 2:
+            return
 
-                    # level 1: check device is enabled for sending commands
-                    if self.config["control_params"]["enabled"]["value"] < 1:
-                        continue
+        # record numerical values
+        if self.read_due(dt):
+            t0 = time.perf_counter()
+            last_data = self.driver.ReadValue()
+            self.metrics.record("ReadValue", time.perf_counter() - t0)
+
+            # loop jitter: deviation of the interval between reads from dt
+            if self.time_last_read:
+                self.metrics.record("jitter", abs(time.time() - self.time_last_read - dt))
+            self.time_last_read = time.time()
+            self.read_count += 1
+
+            # keep track of the number of (sequential and total) NaN returns
+            if isinstance(last_data, float):
+                if np.isnan(last_data):
+                    self.nan_count += 1
+                    if isinstance(self.previous_data, float) and np.isnan(self.previous_data):
+                        self.sequential_nan_count += 1
+                else:
+                    self.sequential_nan_count = 0
+            else:
+                self.sequential_nan_count = 0
+            self.previous_data = last_data
+
+            if last_data and not isinstance(last_data, float):
+                self.push_data(last_data)
+
+            # issue a warning if there's been too many sequential NaN returns
+            try:
+                max_NaN_count = int(self.config["max_NaN_count"])
+            except TypeError:
+                logging.info(traceback.format_exc())
+                max_NaN_count = 10
+            if self.sequential_nan_count > max_NaN_count:
+                warning_dict = {
+                        "message" : "excess sequential NaN returns: " + str(self.sequential_nan_count),
+                        "sequential_NaN_count_exceeded" : 1,
+                    }
+                self.warnings.append([time.time(), warning_dict])
+
+        # telemetry that only goes to InfluxDB, on its own (slower) schedule
+        if self.telemetry_due():
+            self.read_telemetry()
+
+    def telemetry_due(self):
+        if not self.influxdb_sink or not self.config["telemetry_dt"]:
+            return False
+        if not hasattr(self.driver, "ReadTelemetry"):
+            return False
+        return time.time() - self.time_last_telemetry >= self.config["telemetry_dt"]
+
+    def read_telemetry(self):
+        """Write the points returned by the driver's ReadTelemetry(), as
+        (measurement, tags, fields, time in ms) tuples, to InfluxDB."""
+        self.time_last_telemetry = time.time()
+        if not is_enabled(self.config["control_params"]["InfluxDB_enabled"]["value"]):
+            return
+        t0 = time.perf_counter()
+        try:
+            points = self.driver.ReadTelemetry()
+        except Exception as err:
+            logging.warning("Telemetry error in {0}: {1}".format(self.config["name"], err))
+            logging.info(traceback.format_exc())
+            return
+        finally:
+            self.metrics.record("ReadTelemetry", time.perf_counter() - t0)
+        for point in points or []:
+            self.influxdb_sink.write(*point)
+
+    def push_data(self, data):
+        self.config["plots_queue"].append(data)
+        self.latest.publish("data", data)
+        if self.publish_channel is not None:
+            self.publish_channel.push(self.config["name"], data)
+        if self.journal and self.config["control_params"]["HDF_enabled"]["value"]:
+            self.journal.append(self.config["name"], "data", data, self.data_queue)
+        else:
+            self.data_queue.append(data)
+
+    def push_event(self, event):
+        self.latest.publish("event", event)
+        if self.journal and self.config["control_params"]["HDF_enabled"]["value"]:
+            self.journal.append(self.config["name"], "event", event, self.events_queue)
+        else:
+            self.events_queue.append(event)
 
-                    # check device for abnormal conditions
-                    warning = device.GetWarnings()
-                    if warning:
-                        self.warnings += warning
-
-                    # send control commands, if any, to the device, and record return values
-                    for c in self.commands:
-                        try:
-                            ret_val = eval("device." + c.strip())
-                        except Exception as err:
-                            logging.warning(traceback.format_exc())
-                            ret_val = str(err)
-                        if (c == "ReadValue()") and ret_val:
-                            self.data_queue.append(ret_val)
-                            self.config["plots_queue"].append(ret_val)
-                        ret_val = "None" if not ret_val else ret_val
-                        self.last_event = [ time.time()-self.time_offset, c, ret_val ]
-                        self.events_queue.append(self.last_event)
-                    self.commands = []
-
-                    # send sequencer commands, if any, to the device, and record return values
-                    for id0,c in self.sequencer_commands:
-                        try:
-                            ret_val = eval("device." + c.strip())
-                        except Exception as err:
-                            logging.warning(traceback.format_exc())
-                            ret_val = None
-                        if (c == "ReadValue()") and ret_val:
-                            self.data_queue.append(ret_val)
-                            self.config["plots_queue"].append(ret_val)
-                        self.sequencer_events_queue.append([id0, time.time_ns(), c, ret_val])
-                    self.sequencer_commands = []
-
-                    # send monitoring commands, if any, to the device, and record return values
-                    # copy set and clear before iterating to prevent an error when adding to
-                    # monitoring commands while iterating over them
-                    mc = self.monitoring_commands.copy()
-                    self.monitoring_commands.clear()
-                    for c in mc:
-                        try:
-                            ret_val = eval("device." + c.strip())
-                        except Exception as err:
-                            logging.info(traceback.format_exc())
-                            ret_val = str(err)
-                        ret_val = "None" if not ret_val else ret_val
-                        self.monitoring_events_queue.append( [ time.time()-self.time_offset, c, ret_val ] )
-
-                    # send networking commands, if any, to the device, and record return values
-                    for uid, cmd in self.networking_commands:
-                        try:
-                            ret_val = eval("device." + cmd.strip())
-                        except Exception as err:
-                            logging.info(traceback.format_exc())
-                            ret_val = str(err)
-                        self.networking_events_queue[uid] = ret_val
-                    self.networking_commands = []
-
-                    # level 2: check device is enabled for regular ReadValue
-                    if self.config["control_params"]["enabled"]["value"] < 2:
+    def timed_dispatch(self, cmd):
+        # record the call duration under the method name, e.g. "SetFrequency"
+        t0 = time.perf_counter()
+        try:
+            return self.dispatch(cmd)
+        finally:
+            self.metrics.record(cmd.split("(")[0].strip(), time.perf_counter() - t0)
+
+    def get_metrics(self):
+        """Timing histograms, queue depths and NaN statistics, as a
+        JSON-serializable dict."""
+        return {
+                "uptime_s"     : time.time() - self.metrics.time_started,
+                "timings"      : self.metrics.summary(),
+                "queues"       : {
+                    "data_queue"          : len(self.data_queue),
+                    "plots_queue"         : len(self.config["plots_queue"]),
+                    "events_queue"        : len(self.events_queue),
+                    "commands"            : len(self.commands),
+                    "sequencer_commands"  : len(self.sequencer_commands),
+                    "monitoring_commands" : len(self.monitoring_commands),
+                    "networking_commands" : len(self.networking_commands),
+                },
+                "reads"        : self.read_count,
+                "NaN_count"    : self.nan_count,
+                "NaN_rate"     : self.nan_count / self.read_count if self.read_count else 0,
+                "sequential_NaN_count" : self.sequential_nan_count,
+                "cpu_time_s"   : self.cpu_time,
+            }
+
+class DeviceScheduler(threading.Thread):
+    """Runs the main loops of several devices on a shared pool of worker threads.
+
+    Instead of each Device running its own thread, the scheduler submits a
+    single step() of a device's main loop to the pool whenever a command is
+    queued for it or its next ReadValue() is due. Each device has at most one
+    step in flight at any time, so drivers are never called concurrently.
+    """
+    def __init__(self, n_workers):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.active = threading.Event()
+        self.n_workers = n_workers
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+
+        # notified whenever a device is woken up or finishes a step
+        self.condition = threading.Condition()
+        self.max_idle_wait = 1.0
+
+        self.devices = []
+        self.running = set()
+
+    def add_device(self, dev):
+        if not dev.activate():
+            return
+        dev.wakeup.callback = self.notify
+        self.devices.append(dev)
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify()
+
+    def run(self):
+        with self.condition:
+            while self.active.is_set():
+                timeout = self.max_idle_wait
+                for dev in self.devices:
+                    # skip devices that are busy or have been stopped
+                    if dev in self.running or not dev.active.is_set():
                         continue
 
-                    # record numerical values
-                    if time.time() - self.time_last_read >= dt:
-                        last_data = device.ReadValue()
-                        self.time_last_read = time.time()
-
-                        # keep track of the number of (sequential and total) NaN returns
-                        if isinstance(last_data, float):
-                            if np.isnan(last_data):
-                                self.nan_count += 1
-                                if isinstance(self.previous_data, float) and np.isnan(self.previous_data):
-                                    self.sequential_nan_count += 1
-                            else:
-                                self.sequential_nan_count = 0
-                        else:
-                            self.sequential_nan_count = 0
-                        self.previous_data = last_data
-
-                        if last_data and not isinstance(last_data, float):
-                            self.data_queue.append(last_data)
-                            self.config["plots_queue"].append(last_data)
-
-                        # issue a warning if there's been too many sequential NaN returns
-                        try:
-                            max_NaN_count = int(self.config["max_NaN_count"])
-                        except TypeError:
-                            logging.info(traceback.format_exc())
-                            max_NaN_count = 10
-                        if self.sequential_nan_count > max_NaN_count:
-                            warning_dict = {
-                                    "message" : "excess sequential NaN returns: " + str(self.sequential_nan_count),
-                                    "sequential_NaN_count_exceeded" : 1,
-                                }
-                            self.warnings.append([time.time(), warning_dict])
+                    # submit a step if the device was woken up or is due
+                    wait = dev.next_step_time - time.time()
+                    if dev.wakeup.is_set() or wait <= 0:
+                        self.running.add(dev)
+                        self.pool.submit(self.run_step, dev)
+                    else:
+                        timeout = min(timeout, wait)
 
+                self.condition.wait(timeout)
 
-        # report any exception that has occurred in the run() function
+    def run_step(self, dev):
+        try:
+            if dev.driver is None:
+                dev.open_driver()
+            dev.step()
+            dev.next_step_time = time.time() + dev.time_to_next_wakeup(dev.get_dt())
+
+        # as in Device.run(), an exception stops the device
         except Exception as err:
+            dev.report_exception()
+            dev.active.clear()
+            try:
+                dev.close_driver()
+            except Exception as err:
+                logging.warning(traceback.format_exc())
+
+        finally:
+            with self.condition:
+                self.running.discard(dev)
+                self.condition.notify()
+
+    def stop(self):
+        # stop scheduling new steps
+        self.active.clear()
+        self.notify()
+        self.join()
+
+        # wait for the steps in flight, then close the drivers
+        self.pool.shutdown(wait=True)
+        for dev in self.devices:
+            dev.active.clear()
+            try:
+                dev.close_driver()
+            except Exception as err:
+                dev.report_exception()
+
+class InfluxDBSink(threading.Thread):
+    """Writes points to InfluxDB from a background thread, so that a slow or
+    unreachable database does not hold up the threads producing them.
+
+    write() only queues the point. The thread sends the queued points in
+    batches, as line protocol, every flush_interval seconds or as soon as
+    batch_size points are queued. While the database cannot be reached, the
+    points are kept, up to max_points in memory, beyond that (if buffer_fname
+    is set) in a file of up to buffer_mb MB, which also keeps them across a
+    restart of the program, and are sent once the database is back; any
+    further points are dropped, with a warning.
+    """
+    def __init__(self, conf):
+        threading.Thread.__init__(self)
+        self.conf = conf
+        self.active = threading.Event()
+        self.flush_requested = threading.Event()
+        self.client = None
+
+        def setting(key, typ, default):
+            try:
+                return typ(conf.get(key, default))
+            except ValueError:
+                logging.warning("Invalid InfluxDB {0}, using {1}.".format(key, default))
+                return typ(default)
+        self.batch_size     = max(setting("batch_size", int, 5000), 1)
+        self.flush_interval = setting("flush_interval", float, 1.0)
+        self.max_points     = max(setting("max_points", int, 100000), self.batch_size)
+        self.buffer_fname   = conf.get("buffer_fname", "")
+        self.buffer_bytes   = 1e6 * setting("buffer_mb", float, 100)
+
+        # the queued points, as (measurement, tags, fields, time in ms)
+        self.points = deque()
+
+        # retry with an exponential backoff while the database is unreachable
+        self.backoff = 0
+        self.time_next_attempt = 0
+
+        # statistics, e.g. for the monitoring
+        self.n_sent = 0
+        self.n_dropped = 0
+        self.time_last_warning = 0
+
+    def write(self, measurement, tags, fields, time_ms):
+        if len(self.points) >= self.max_points and not self.buffer_fname:
+            self.drop(1)
+            return
+        self.points.append((measurement, tags, fields, time_ms))
+        if len(self.points) >= self.batch_size:
+            self.flush_requested.set()
+
+    def run(self):
+        while self.active.is_set():
+            self.flush_requested.wait(self.flush_interval)
+            self.flush_requested.clear()
+            self.flush()
+
+        # a last attempt to send everything, and keep on disk what can't be sent
+        self.time_next_attempt = 0
+        self.flush(final=True)
+
+    def stop(self):
+        self.active.clear()
+        self.flush_requested.set()
+        if self.is_alive():
+            self.join()
+
+    def connect(self):
+        self.client = InfluxDBClient(
+                host     = self.conf["host"],
+                port     = self.conf["port"],
+                username = self.conf["username"],
+                password = self.conf["password"],
+                database = self.conf["database"],
+                timeout  = 10,
+                retries  = 1,
+            )
+
+    def flush(self, final=False):
+        # while the database is unreachable, move what doesn't fit in memory to disk
+        if time.time() < self.time_next_attempt:
+            self.spill(self.max_points)
+            return
+
+        # points buffered on disk go first, to keep the order
+        if self.buffer_fname and os.path.exists(self.buffer_fname):
+            if not self.send_buffered():
+                self.spill(0 if final else self.max_points)
+                return
+
+        while self.points:
+            lines = self.take(self.batch_size)
+            if not self.send(lines):
+                self.points_failed(lines)
+                self.spill(0 if final else self.max_points)
+                return
+            if not final and len(self.points) < self.batch_size:
+                return
+
+    def take(self, n):
+        lines = []
+        while self.points and len(lines) < n:
+            line = self.format_line(*self.points.popleft())
+            if line:
+                lines.append(line)
+        return lines
+
+    def send(self, lines):
+        if not lines:
+            return True
+        try:
+            if self.client is None:
+                self.connect()
+            self.client.write_points(lines, time_precision='ms', protocol='line')
+        except InfluxDBClientError as err:
+            # the database rejected the points (e.g. a field changed type); no
+            # use sending them again
+            if err.code is not None and 400 <= err.code < 500 and err.code not in [401, 403, 404]:
+                logging.warning("InfluxDB rejected {0} points: {1}".format(len(lines), err))
+                self.drop(len(lines))
+                return True
+            self.failed(err)
+            return False
+        except Exception as err:
+            self.failed(err)
+            return False
+        self.n_sent += len(lines)
+        self.backoff = 0
+        self.time_next_attempt = 0
+        return True
+
+    def failed(self, err):
+        self.backoff = min(2*self.backoff, 60) if self.backoff else self.flush_interval
+        self.time_next_attempt = time.time() + self.backoff
+        if time.time() - self.time_last_warning > 60:
+            self.time_last_warning = time.time()
+            logging.warning("InfluxDB error, retrying in {0:.0f} s: {1}".format(self.backoff, err))
             logging.info(traceback.format_exc())
-            err_msg = traceback.format_exc()
-            warning_dict = {
-                    "message" : "exception in " + self.config["name"] + ": "+err_msg,
-                    "exception" : 1,
-                }
-            self.warnings.append([time.time(), warning_dict])
+
+    def points_failed(self, lines):
+        # keep the lines of a failed batch, on disk or in front of the queue
+        if self.buffer_fname:
+            self.append_to_buffer(lines)
+        else:
+            self.points.extendleft(reversed([(None, None, line, None) for line in lines]))
+            while len(self.points) > self.max_points:
+                self.points.pop()
+                self.drop(1)
+
+    def spill(self, n_keep):
+        # move the oldest points to the disk buffer, keeping n_keep in memory
+        if not self.buffer_fname or len(self.points) <= n_keep:
+            return
+        self.append_to_buffer(self.take(len(self.points) - n_keep))
+
+    def append_to_buffer(self, lines):
+        try:
+            size = os.path.getsize(self.buffer_fname) if os.path.exists(self.buffer_fname) else 0
+            n = len(lines)
+            while lines and size + sum(len(line)+1 for line in lines) > self.buffer_bytes:
+                lines = lines[:len(lines)//2]
+            if len(lines) < n:
+                self.drop(n - len(lines))
+            with open(self.buffer_fname, "a", encoding="utf-8") as f:
+                f.writelines(line + "\n" for line in lines)
+        except OSError as err:
+            logging.warning("Cannot buffer InfluxDB points in {0}: {1}".format(self.buffer_fname, err))
+            self.drop(len(lines))
+
+    def send_buffered(self):
+        # send the buffered lines in batches, and keep those that couldn't be sent
+        try:
+            with open(self.buffer_fname, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError as err:
+            logging.warning("Cannot read InfluxDB buffer {0}: {1}".format(self.buffer_fname, err))
+            return True
+        for i in range(0, len(lines), self.batch_size):
+            if not self.send(lines[i:i+self.batch_size]):
+                with open(self.buffer_fname, "w", encoding="utf-8") as f:
+                    f.writelines(line + "\n" for line in lines[i:])
+                return False
+        os.remove(self.buffer_fname)
+        return True
+
+    def drop(self, n):
+        self.n_dropped += n
+        if time.time() - self.time_last_warning > 60:
+            self.time_last_warning = time.time()
+            logging.warning("InfluxDB buffer full, {0} points dropped so far.".format(self.n_dropped))
+
+    @staticmethod
+    def format_line(measurement, tags, fields, time_ms):
+        """A point in InfluxDB line protocol, or None if it has no valid fields.
+        Points put back after a failed write are already formatted."""
+        if measurement is None:
+            return fields
+
+        def escape(s, chars):
+            s = str(s)
+            for c in chars:
+                s = s.replace(c, "\\" + c)
+            return s
+
+        values = []
+        for key, val in fields.items():
+            if isinstance(val, (bool, np.bool_)):
+                val = "true" if val else "false"
+            elif isinstance(val, (int, np.integer)):
+                val = str(int(val)) + "i"
+            elif isinstance(val, (float, np.floating)):
+                if not np.isfinite(val):
+                    continue
+                val = repr(float(val))
+            else:
+                val = '"' + str(val).replace("\\", "\\\\").replace('"', '\\"') + '"'
+            values.append(escape(key, ", =") + "=" + val)
+        if not values:
+            return None
+
+        line = escape(measurement, ", ")
+        for key, val in sorted(tags.items()):
+            line += "," + escape(key, ", =") + "=" + escape(val, ", =")
+        return line + " " + ",".join(values) + " " + str(int(time_ms))
 
 class Monitoring(threading.Thread,PyQt5.QtCore.QObject):
     # signal to update the style of a QWidget
@@ -436,15 +1338,20 @@ class Monitoring(threading.Thread,PyQt5.QtCore.QObject):
 
         self.time_last_monitored = 0
 
-        # connect to InfluxDB
-        conf = self.parent.config["influxdb"]
-        self.influxdb_client = InfluxDBClient(
-                host     = conf["host"],
-                port     = conf["port"],
-                username = conf["username"],
-                password = conf["password"],
-            )
-        self.influxdb_client.switch_database(self.parent.config["influxdb"]["database"])
+        # for computing CPU usage since the previous pass of the loop
+        self.time_last_cpu = time.time()
+        self.process_time_last = time.process_time()
+        self.device_cpu_time_last = {}
+
+        # points are written to InfluxDB in the background
+        self.influxdb_sink = self.parent.ControlGUI.influxdb_sink
+
+        # for each device, the versions of its latest state already displayed,
+        # the scheduler of its indicators' monitoring commands, and the last
+        # row not yet written to InfluxDB
+        self.seen = {}
+        self.indicator_schedulers = {}
+        self.influxdb_pending = {}
 
     def run(self):
         while self.active.is_set():
@@ -461,6 +1368,17 @@ class Monitoring(threading.Thread,PyQt5.QtCore.QObject):
             # update style
             self.update_style.emit(HDF_status)
 
+            # CPU usage of the program and of each device since the last pass
+            cpu_dt = max(time.time() - self.time_last_cpu, 1e-6)
+            self.time_last_cpu = time.time()
+            process_time = time.process_time()
+            scheduler = self.parent.ControlGUI.scheduler
+            self.parent.ControlGUI.cpu_usage.setText("{0:.1f}% ({1})".format(
+                    100*(process_time - self.process_time_last)/cpu_dt,
+                    "pool of {0}".format(scheduler.n_workers) if scheduler else "threads",
+                ))
+            self.process_time_last = process_time
+
             # monitoring dt
             try:
                 dt = float(self.parent.config["general"]["monitoring_dt"])
@@ -483,7 +1401,7 @@ class Monitoring(threading.Thread,PyQt5.QtCore.QObject):
                     logging.warning("Abnormal condition in " + str(dev_name))
                     for warning in dev.warnings:
                         logging.warning(str(warning))
-                        if self.parent.config["influxdb"]["enabled"] in [1, 2, "2", "1", "True"]:
+                        if is_enabled(self.parent.config["influxdb"]["enabled"]):
                             self.push_warnings_to_influxdb(dev_name, warning)
                         self.parent.ControlGUI.update_warnings(str(warning))
                     dev.warnings = []
@@ -491,24 +1409,47 @@ class Monitoring(threading.Thread,PyQt5.QtCore.QObject):
                 # find out and display the data queue length
                 dev.config["monitoring_GUI_elements"]["qsize"].setText(str(len(dev.data_queue)))
 
-                # get the last event (if any) of the device
-                self.display_last_event(dev)
+                # display the latency between waking up the device and dispatching to it
+                latency = list(dev.wake_latency)
+                if latency:
+                    dev.config["monitoring_GUI_elements"]["wake_latency"].setText(
+                            "{0:.2f} / {1:.2f} ms".format(1e3*np.mean(latency), 1e3*np.max(latency))
+                        )
 
-                # send monitoring commands
-                for c_name, params in dev.config["control_params"].items():
-                    if params.get("type") in ["indicator", "indicator_button", "indicator_lineedit"]:
-                        dev.monitoring_commands.add( params["monitoring_command"] )
+                # display the fraction of a core used by the device main loop
+                cpu_time = dev.cpu_time
+                cpu_time_last = self.device_cpu_time_last.get(dev_name, cpu_time)
+                dev.config["monitoring_GUI_elements"]["cpu_usage"].setText(
+                        "{0:.1f}%".format(100*(cpu_time - cpu_time_last)/cpu_dt)
+                    )
+                self.device_cpu_time_last[dev_name] = cpu_time
 
-                # obtain monitoring events and update any indicator controls
-                self.display_monitoring_events(dev)
+                # display the NaN count and rate
+                metrics = dev.get_metrics()
+                dev.config["monitoring_GUI_elements"]["NaN_count"].setText(
+                        "{0} ({1:.1f}%)".format(metrics["NaN_count"], 100*metrics["NaN_rate"])
+                    )
 
-                # get the last row of data from the plots_queue
-                if len(dev.config["plots_queue"]) > 0:
-                    data = dev.config["plots_queue"][-1]
-                else:
-                    data = None
+                # display the slowest driver call (p99) and the loop jitter
+                self.display_timing(dev, metrics)
+
+                # what the device published since the previous pass
+                changed = dev.latest.changed(self.seen.setdefault(dev_name, {}))
 
-                # format the data
+                # display the last event, if there is a new one
+                if "event" in changed:
+                    self.display_last_event(dev, changed["event"])
+
+                # send the monitoring commands that are due (once per command)
+                for c in self.indicator_scheduler(dev).due():
+                    dev.monitoring_commands.add(c)
+
+                # update the indicator controls whose monitoring commands returned
+                self.display_monitoring_events(dev, {key[1] : ret_val
+                    for key, ret_val in changed.items() if isinstance(key, tuple)})
+
+                # format the last row of data, if there is a new one
+                data = changed.get("data")
                 if isinstance(data, list):
                     try:
                         if dev.config["slow_data"]:
@@ -520,9 +1461,12 @@ class Monitoring(threading.Thread,PyQt5.QtCore.QObject):
                         logging.warning(traceback.format_exc())
                         continue
                     dev.config["monitoring_GUI_elements"]["data"].setText("\n".join(formatted_data))
+                    self.influxdb_pending[dev_name] = data
 
-                    # write slow data to InfluxDB
-                    if time.time() - self.time_last_monitored >= dt:
+                # write slow data to InfluxDB (each row at most once)
+                if time.time() - self.time_last_monitored >= dt:
+                    data = self.influxdb_pending.pop(dev_name, None)
+                    if data is not None:
                         self.write_to_influxdb(dev, data)
 
                 # if writing to HDF is disabled, empty the queues
@@ -539,9 +1483,9 @@ class Monitoring(threading.Thread,PyQt5.QtCore.QObject):
 
     def write_to_influxdb(self, dev, data):
         # check writing to InfluxDB is enabled
-        if not self.parent.config["influxdb"]["enabled"] in [1, 2, "1", "2", "True"]:
+        if not is_enabled(self.parent.config["influxdb"]["enabled"]):
             return
-        if not dev.config["control_params"]["InfluxDB_enabled"]["value"] in [1, 2, "1", "2", "True"]:
+        if not is_enabled(dev.config["control_params"]["InfluxDB_enabled"]["value"]):
             return
 
         # only slow data can write to InfluxDB
@@ -565,53 +1509,38 @@ class Monitoring(threading.Thread,PyQt5.QtCore.QObject):
                     logging.warning(f"Error in write_to_influxdb: {str(e)}")
             return
             
-        # format the message for InfluxDB
-        json_body = [
-                {
-                    "measurement": dev.config["name"],
-                    "tags": { "run_name": self.parent.run_name, },
-                    "time": int(1000 * (data[0] + self.parent.config["time_offset"])),
-                    "fields": fields,
-                    }
-                ]
+        # queue for InfluxDB
+        self.influxdb_sink.write(
+                measurement = dev.config["name"],
+                tags        = { "run_name": self.parent.run_name, },
+                fields      = fields,
+                time_ms     = 1000 * (data[0] + self.parent.config["time_offset"]),
+            )
 
-        # push to InfluxDB
-        try:
-            self.influxdb_client.write_points(json_body, time_precision='ms')
-        except Exception as err:
-            logging.warning("InfluxDB error: " + str(err))
-            logging.warning(traceback.format_exc())
+    def indicator_scheduler(self, dev):
+        # made on the first pass, since the controls don't change while running
+        scheduler = self.indicator_schedulers.get(dev.config["name"])
+        if scheduler is None:
+            scheduler = IndicatorScheduler(dev)
+            self.indicator_schedulers[dev.config["name"]] = scheduler
+        return scheduler
 
-    def display_monitoring_events(self, dev):
+    def display_monitoring_events(self, dev, returns):
         # check device enabled
         if not dev.config["control_params"]["enabled"]["value"] == 2:
             return
 
-        # empty the monitoring events queue
-        monitoring_events = []
-        while len(dev.monitoring_events_queue) > 0:
-            monitoring_events.append( dev.monitoring_events_queue.pop() )
-
-        # check any events were returned
-        if not monitoring_events:
-            return
-
-        for c_name, params in dev.config["control_params"].items():
-            # check we're dealing with indicator controls
-            if not params.get("type") in ["indicator", "indicator_button", "indicator_lineedit"]:
-                continue
-
-            # check the returned events
-            for event in monitoring_events:
-                # skip event if it's related to a different command
-                if not params["monitoring_command"] == event[1]:
-                    continue
+        # update only the indicators whose monitoring command returned a new value
+        indicators = self.indicator_scheduler(dev).indicators
+        for c, ret_val in returns.items():
+            for c_name in indicators.get(c, []):
+                params = dev.config["control_params"][c_name]
 
                 # check if there's any matching return value
                 if params.get("type") in ["indicator", "indicator_button"]:
                     try:
-                        if event[2] in params["return_values"]:
-                            idx = params["return_values"].index(event[2])
+                        if ret_val in params["return_values"]:
+                            idx = params["return_values"].index(ret_val)
                         else:
                             idx = -2
                     except ValueError:
@@ -638,56 +1567,57 @@ class Monitoring(threading.Thread,PyQt5.QtCore.QObject):
                 elif params.get("type") == "indicator_lineedit":
                     if not dev.config["control_GUI_elements"][c_name]["currently_editing"]:
                         ind = dev.config["control_GUI_elements"][c_name]["QLineEdit"]
-                        ind.setText(str(event[2]))
+                        ind.setText(str(ret_val))
 
-    def display_last_event(self, dev):
+    def display_timing(self, dev, metrics):
+        timings = metrics["timings"]
+        calls = {name: t for name, t in timings.items() if name not in ["jitter", "wake latency"]}
+        if not calls:
+            return
+        slowest = max(calls, key=lambda name: calls[name]["p99_ms"])
+        text = "{0} {1:.1f} ms".format(slowest, calls[slowest]["p99_ms"])
+        if "jitter" in timings:
+            text += ", jitter {0:.1f} ms".format(timings["jitter"]["p99_ms"])
+        dev.config["monitoring_GUI_elements"]["timing"].setText(text)
+
+        # full table in the tooltip
+        lines = ["{0:20s} {1:>8s} {2:>9s} {3:>9s} {4:>9s}".format("", "count", "mean [ms]", "p99 [ms]", "max [ms]")]
+        for name, t in sorted(timings.items()):
+            lines.append("{0:20s} {1:8d} {2:9.2f} {3:9.2f} {4:9.2f}".format(
+                    name[:20], t["count"], t["mean_ms"], t["p99_ms"], t["max_ms"]))
+        lines += ["{0}: {1}".format(q, n) for q, n in metrics["queues"].items()]
+        dev.config["monitoring_GUI_elements"]["timing"].setToolTip(
+                "<pre>" + "\n".join(lines) + "</pre>")
+
+    def display_last_event(self, dev, last_event):
         # check device enabled
         if not dev.config["control_params"]["enabled"]["value"] == 2:
             return
 
-        # if HDF writing enabled for this device, get events from the HDF file
-        if dev.config["control_params"]["HDF_enabled"]["value"]:
-            with h5py.File(self.hdf_fname, 'r') as f:
-                grp = f[self.parent.run_name + "/" + dev.config["path"]]
-                events_dset = grp[dev.config["name"] + "_events"]
-                if events_dset.shape[0] == 0:
-                    dev.config["monitoring_GUI_elements"]["events"].setText("(no event)")
-                    return
-                else:
-                    last_event = events_dset[-1]
-                    dev.config["monitoring_GUI_elements"]["events"].setText(str(last_event))
-                    return last_event
-
-        # if HDF writing not enabled for this device, get events from the events_queue
-        else:
-            try:
-                last_event = dev.events_queue.pop()
-                dev.config["monitoring_GUI_elements"]["events"].setText(str(last_event))
-                return last_event
-            except IndexError:
-                logging.info(traceback.format_exc())
-                return
+        # the device publishes its last event in memory, so there's no need to
+        # read it back from the HDF file
+        dev.config["monitoring_GUI_elements"]["events"].setText(str(last_event))
 
     def push_warnings_to_influxdb(self, dev_name, warning):
-        json_body = [
-                {
-                    "measurement": "warnings",
-                    "tags": {
-                        "run_name": self.parent.run_name,
-                        "dev_name": dev_name,
-                        },
-                    "time": int(1000 * warning[0]),
-                    "fields": warning[1],
-                    }
-                ]
-        self.influxdb_client.write_points(json_body, time_precision='ms')
+        self.influxdb_sink.write(
+                measurement = "warnings",
+                tags        = {
+                    "run_name": self.parent.run_name,
+                    "dev_name": dev_name,
+                    },
+                fields      = warning[1],
+                time_ms     = 1000 * warning[0],
+            )
 
 class NetworkingDeviceWorker(threading.Thread):
-    def __init__(self, parent, backend_port):
+    def __init__(self, parent, backend_port, timeout=5):
         super(NetworkingDeviceWorker, self).__init__()
         self.active = threading.Event()
         self.daemon = True
         self.parent = parent
+
+        # how long to wait for the device to execute a command (in seconds)
+        self.timeout = timeout
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.REP)
         # connect to the ipc backend
@@ -704,48 +1634,128 @@ class NetworkingDeviceWorker(threading.Thread):
     def run(self):
         logging.info(f"NetworkingDeviceWorker: started worker {self.uid}")
         while self.active.is_set():
-            # receive the request from a client
-            device, command = self.socket.recv_json()
-            logging.info(f"{self.uid} : {device} {command}")
-
-            # strip both to prevent whitespace errors during eval on device
-            device.strip()
-            command.strip()
-            # check if device present
-            if device not in self.parent.devices:
-                self.socket.send_json(["ERROR", "device not present"])
-                continue
-            dev = self.parent.devices[device]
-            # check if device control is started
-            if not dev.control_started:
-                self.socket.send_json(["ERROR", "device not started"])
-                continue
-            # check if device is enabled
-            elif not dev.config["control_params"]["enabled"]["value"] == 2:
-                self.socket.send_json(["ERROR", "device not enabled"])
+            # receive the request from a client: [device, command], or a batch,
+            # either [[device, command], ...] or [device, [command, ...]]
+            try:
+                request = self.socket.recv_json()
+            except ValueError:
+                # the REP socket has to reply before receiving the next request
+                self.socket.send_json(["ERROR", "request is not valid JSON"])
                 continue
-            # check if device is slow data
-            # ndarrays are not serializable by default, and fast devices return
-            # ndarrays on ReadValue()
-            elif not dev.config['slow_data'] and command == 'ReadValue()':
-                self.socket.send_json(["ERROR", "device does not support slow data"])
+            logging.info(f"{self.uid} : {request}")
+
+            # anything else is answered with an error rather than raising,
+            # which would end the worker with the request unanswered
+            if isinstance(request, list) and request and isinstance(request[0], list):
+                reply = ["OK", self.execute_batch(request)]
+            elif isinstance(request, list) and len(request) == 2 and isinstance(request[1], list):
+                device, commands = request
+                reply = ["OK", self.execute_batch([[device, c] for c in commands])]
+            elif self.is_command(request):
+                device, command = request
+                reply = self.execute(device, command)
             else:
-                # put command into the networking queue
-                dev.networking_commands.append((self.uid, command))
-                while True:
-                    # check if uid is present in return val dictionary and pop
-                    # if present
-                    if self.uid in dev.networking_events_queue:
-                        ret_val = dev.networking_events_queue.pop(self.uid)
-                        # serialize with json and send back to client
-                        self.socket.send_json(["OK", ret_val])
-                        break
-            # need a sleep to release to other threads
-            time.sleep(1e-4)
+                reply = ["ERROR", "invalid request, expected [device, command] or a batch"]
+            # serialize with json and send back to client
+            self.socket.send_json(reply)
         self.socket.setsockopt(zmq.LINGER, 0)
         self.socket.close()
         self.context.term()
 
+    @staticmethod
+    def is_command(request):
+        # a [device, command] pair of strings
+        return (isinstance(request, list) and len(request) == 2
+                and all(isinstance(x, str) for x in request))
+
+    def check(self, device, command):
+        """Return the reply to requests that are not to be passed on to the
+        device (e.g. errors), or None if the command is to be executed."""
+        # check if device present
+        if device not in self.parent.devices:
+            return ["ERROR", "device not present"]
+        dev = self.parent.devices[device]
+        # check if device control is started
+        if not dev.control_started:
+            return ["ERROR", "device not started"]
+        # timing metrics are answered here rather than by the driver, so
+        # that they're available even if the device main loop is stuck
+        elif command == "GetDeviceMetrics()":
+            return ["OK", dev.get_metrics()]
+        # check if device is enabled
+        elif not dev.config["control_params"]["enabled"]["value"] == 2:
+            return ["ERROR", "device not enabled"]
+        # check if device is slow data
+        # ndarrays are not serializable by default, and fast devices return
+        # ndarrays on ReadValue(); their data is published (in binary) on
+        # the readout port instead
+        elif not dev.config['slow_data'] and command == 'ReadValue()':
+            return ["ERROR", "device does not support slow data, subscribe to readout"]
+        return None
+
+    def execute(self, device, command):
+        # strip both to prevent whitespace errors during eval on device
+        device = device.strip()
+        command = command.strip()
+        reply = self.check(device, command)
+        if reply:
+            return reply
+
+        # put command into the networking queue, with a future for the
+        # device to set the return value of
+        reply = concurrent.futures.Future()
+        self.parent.devices[device].networking_commands.append((reply, command))
+        try:
+            return ["OK", self.wait_for_reply(reply, self.timeout)]
+        except concurrent.futures.TimeoutError:
+            # the device won't execute the command if it hasn't started it yet
+            reply.cancel()
+            logging.warning(f"{self.uid} : no reply from {device} to {command}")
+            return ["ERROR", f"no reply from device within {self.timeout} s"]
+
+    def execute_batch(self, requests):
+        """Execute a list of [device, command] pairs, and return the list of
+        their [status, return value]. The commands of each device are queued
+        together, so that they're executed in order in one pass of its main
+        loop; different devices execute theirs concurrently."""
+        replies = [None] * len(requests)
+        batches = {}
+        for i, request in enumerate(requests):
+            if not self.is_command(request):
+                replies[i] = ["ERROR", "invalid request, expected [device, command]"]
+                continue
+            device, command = request
+            device = device.strip()
+            command = command.strip()
+            replies[i] = self.check(device, command)
+            if not replies[i]:
+                batches.setdefault(device, []).append((i, command))
+
+        # queue one batch per device
+        futures = []
+        for device, batch in batches.items():
+            future = concurrent.futures.Future()
+            self.parent.devices[device].networking_commands.append(
+                    (future, [command for i, command in batch]))
+            futures.append((device, future, batch))
+
+        # wait for all of them, for at most timeout in total
+        deadline = time.time() + self.timeout
+        for device, future, batch in futures:
+            try:
+                ret_vals = self.wait_for_reply(future, max(deadline - time.time(), 0))
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                logging.warning(f"{self.uid} : no reply from {device} to batch")
+                ret_vals = [["ERROR", f"no reply from device within {self.timeout} s"]] * len(batch)
+            for (i, command), ret_val in zip(batch, ret_vals):
+                replies[i] = ret_val
+        return replies
+
+    def wait_for_reply(self, reply, timeout):
+        # blocks (without using the CPU) until the device thread sets the result
+        return reply.result(timeout=timeout)
+
 class NetworkingBroker(threading.Thread):
     def __init__(self, outward_port, allowed):
         super(NetworkingBroker, self).__init__()
@@ -802,6 +1812,35 @@ class NetworkingBroker(threading.Thread):
         except zmq.error.ZMQError:
             pass
 
+class NetworkingSnapshot(threading.Thread):
+    """Answers snapshot requests of subscribers joining late (as in the ZMQ
+    "Clone" pattern): the request is a topic, the reply the frames last
+    published on it, or a single empty frame if nothing has been published
+    yet."""
+    def __init__(self, port, last_values):
+        super(NetworkingSnapshot, self).__init__()
+        self.active = threading.Event()
+        self.daemon = True
+
+        # the last frames published on each topic, kept by Networking.publish()
+        self.last_values = last_values
+
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.REP)
+        self.socket.bind(f"tcp://*:{port}")
+
+    def run(self):
+        logging.info("NetworkingSnapshot: started snapshot server")
+        while self.active.is_set():
+            # poll with a timeout, to notice when networking is stopped
+            if not self.socket.poll(500):
+                continue
+            topic = self.socket.recv_string()
+            self.socket.send_multipart(self.last_values.get(topic, [b""]), copy=False)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.close()
+        self.context.term()
+
 class Networking(threading.Thread):
     def __init__(self, parent):
         super(Networking, self).__init__()
@@ -817,17 +1856,44 @@ class Networking(threading.Thread):
         self.socket_readout = self.context_readout.socket(zmq.PUB)
         self.socket_readout.bind(f"tcp://*:{self.conf['port_readout']}")
 
-        # dictionary with timestamps of last ReadValue update per device
-        self.devices_last_updated = {dev_name: 0 for dev_name in
-                                                    self.parent.devices.keys()}
+        # the devices push each new ReadValue result onto the channel
+        self.channel = PublishChannel()
+        for dev in self.parent.devices.values():
+            dev.publish_channel = self.channel
+
+        # to publish only the latest row of each device, at most every
+        # conflate_dt seconds (0: publish every row)
+        try:
+            self.conflate_dt = float(self.conf.get("conflate_dt", 0))
+        except ValueError:
+            logging.info(traceback.format_exc())
+            self.conflate_dt = 0
+        self.conflated = {}
+        self.time_last_published = {}
+
+        # the last frames published on each topic, for subscribers to request
+        # on the snapshot port (if any) when they join
+        self.last_values = {}
+        if self.conf.get("port_snapshot"):
+            self.snapshot_server = NetworkingSnapshot(self.conf["port_snapshot"], self.last_values)
+        else:
+            self.snapshot_server = None
 
         # initialize the broker for network control of devices
         allowed = self.conf["allowed"].split(',')
         self.control_broker = NetworkingBroker(self.conf['port_control'], allowed)
 
+        # how long the workers wait for a device to execute a command (less
+        # than the NetworkingClient waits for a reply, so that it gets an error)
+        try:
+            timeout = float(self.conf.get("timeout", 5))
+        except ValueError:
+            logging.info(traceback.format_exc())
+            timeout = 5
+
         # initialize the workers used for network control of devices
         backend_port = self.control_broker.backend_port
-        self.workers = [NetworkingDeviceWorker(parent, backend_port)
+        self.workers = [NetworkingDeviceWorker(parent, backend_port, timeout)
                                     for _ in range(int(self.conf['workers']))]
 
     def encode(self, topic, message):
@@ -836,6 +1902,54 @@ class Networking(threading.Thread):
         """
         return topic + " " + json.dumps(message)
 
+    def time_to_next_publish(self):
+        # wake up at least every 0.5 s, to notice when networking is stopped
+        timeout = 0.5
+        for dev_name in self.conflated:
+            t_next = self.time_last_published.get(dev_name, 0) + self.conflate_dt
+            timeout = min(timeout, max(t_next - time.time(), 0))
+        return timeout
+
+    def publish(self, dev_name, data, timestamp):
+        dev = self.parent.devices[dev_name]
+
+        # check if device is a network client, don't retransmit data
+        # from a network client device
+        if getattr(dev, 'is_networking_client', None):
+            return
+
+        if not isinstance(data, list):
+            return
+
+        topic = f"{self.conf['name']}-{dev_name}"
+        if dev.config["slow_data"]:
+            message = [dev.time_offset + data[0]] + data[1:]
+            frames = [self.encode(topic, message).encode()]
+        # fast data isn't json serializable, and is sent as binary
+        else:
+            frames = self.encode_waveforms(topic, dev, data, timestamp)
+        self.socket_readout.send_multipart(frames, copy=False)
+        self.last_values[topic] = frames
+
+    def encode_waveforms(self, topic, dev, data, timestamp):
+        """
+        Function encodes fast-device data, [waveforms, attrs] as returned by
+        ReadValue(), as the frames of a multipart message: the topic, a json
+        header (dtype, shape, timestamp, time_offset, attrs), and the raw
+        buffer of the waveforms, which is sent without copying; timestamp is
+        the time the data was pushed to the PublishChannel
+        """
+        waveforms, attrs = data
+        waveforms = np.ascontiguousarray(waveforms)
+        header = {
+                "dtype"       : waveforms.dtype.str,
+                "shape"       : waveforms.shape,
+                "timestamp"   : timestamp,
+                "time_offset" : dev.time_offset,
+                "attrs"       : attrs,
+            }
+        return [topic.encode(), json.dumps(header, default=to_json).encode(), waveforms]
+
     def run(self):
         logging.warning("Networking: started main thread")
         # start the message broker
@@ -844,6 +1958,10 @@ class Networking(threading.Thread):
         for worker in self.workers:
             worker.active.set()
             worker.start()
+        # start the snapshot server
+        if self.snapshot_server:
+            self.snapshot_server.active.set()
+            self.snapshot_server.start()
 
         for dev_name, dev in self.parent.devices.items():
             # check device running
@@ -860,62 +1978,351 @@ class Networking(threading.Thread):
             logging.warning(f"{dev_name} networking")
 
         while self.active.is_set():
-            for dev_name, dev in self.parent.devices.items():
-                # check device running
-                if not dev.control_started:
-                    continue
-                # check device enabled
-                if not dev.config["control_params"]["enabled"]["value"] == 2:
-                    continue
-
-                # check if device is a network client, don't retransmit data
-                # from a network client device
-                if getattr(dev, 'is_networking_client', None):
-                    continue
-
-                if len(dev.config["plots_queue"]) > 0:
-                    data = dev.config["plots_queue"][-1]
+            # sleep until the devices push new rows (or a conflated row is due)
+            for dev_name, data, timestamp in self.channel.get(self.time_to_next_publish()):
+                if self.conflate_dt:
+                    self.conflated[dev_name] = (data, timestamp)
                 else:
-                    data = None
+                    self.publish(dev_name, data, timestamp)
 
-                if isinstance(data, list):
-                    if dev.config["slow_data"]:
-                        t_readout = data[0]
-                        if self.devices_last_updated[dev_name] != t_readout:
-                            self.devices_last_updated[dev_name] = t_readout
-                            topic = f"{self.conf['name']}-{dev_name}"
-                            message = [dev.time_offset + data[0]] + data[1:]
-                            self.socket_readout.send_string(self.encode(topic, message))
+            # publish the latest row of devices not published for conflate_dt
+            for dev_name in list(self.conflated):
+                if time.time() - self.time_last_published.get(dev_name, 0) >= self.conflate_dt:
+                    self.time_last_published[dev_name] = time.time()
+                    self.publish(dev_name, *self.conflated.pop(dev_name))
 
-                time.sleep(1e-5)
+        # stop the devices pushing to the channel
+        for dev in self.parent.devices.values():
+            dev.publish_channel = None
 
         # close the message broker and workers when stopping network control
         for worker in self.workers:
             worker.active.clear()
+        if self.snapshot_server:
+            self.snapshot_server.active.clear()
         self.control_broker.__exit__()
         self.socket_readout.close()
         self.context_readout.term()
 
+class WaveformCompressor:
+    """Compresses fast-device records into HDF chunks outside of the HDF file.
+
+    The chunks are compressed exactly as the HDF5 filter pipeline declared by
+    dataset_kwargs() would, so that they can be written with
+    write_direct_chunk() and read back by any HDF5 reader. Supported methods
+    are "gzip" (zlib), and, if hdf5plugin and the corresponding Python module
+    are installed, "zstd" and "blosc"; other methods supported by h5py (e.g.
+    "lzf") are applied by HDF5 itself when writing.
+    """
+    def __init__(self, method, level=None, shuffle=True):
+        self.method = method
+        self.level = level
+        self.shuffle = shuffle
+
+        if method == "gzip":
+            self.direct = True
+        elif method == "zstd":
+            self.direct = bool(hdf5plugin and zstandard)
+            if self.direct:
+                self.zstd = zstandard.ZstdCompressor(level=3 if level is None else level)
+        elif method == "blosc":
+            self.direct = bool(hdf5plugin and blosc)
+        else:
+            self.direct = False
+
+        if method in ["zstd", "blosc"] and not self.direct:
+            raise ValueError("compression {0} requires hdf5plugin and {1}".format(
+                method, "zstandard" if method == "zstd" else "blosc"))
+
+    def dataset_kwargs(self):
+        # the filters to declare when creating the dataset
+        if self.method == "zstd":
+            return {"compression" : hdf5plugin.Zstd(clevel=3 if self.level is None else self.level),
+                    "shuffle"     : self.shuffle}
+        elif self.method == "blosc":
+            # blosc shuffles internally
+            return {"compression" : hdf5plugin.Blosc(cname="lz4", clevel=5 if self.level is None else self.level,
+                        shuffle=hdf5plugin.Blosc.SHUFFLE if self.shuffle else hdf5plugin.Blosc.NOSHUFFLE)}
+        else:
+            return {"compression" : self.method, "compression_opts" : self.level,
+                    "shuffle"     : self.shuffle}
+
+    def compress(self, arr):
+        arr = np.ascontiguousarray(arr)
+
+        if self.method == "blosc":
+            return blosc.compress(arr.tobytes(), typesize=arr.itemsize,
+                    clevel=5 if self.level is None else self.level,
+                    shuffle=blosc.SHUFFLE if self.shuffle else blosc.NOSHUFFLE, cname="lz4")
+
+        # HDF5 shuffle filter: the first bytes of all elements, then the second
+        # bytes, ...; otherwise, compress the record's buffer without copying it
+        if self.shuffle and arr.itemsize > 1:
+            data = arr.view(np.uint8).reshape(-1, arr.itemsize).T.tobytes()
+        else:
+            data = arr.reshape(-1).view(np.uint8)
+
+        if self.method == "gzip":
+            return zlib.compress(data, 4 if self.level is None else self.level)
+        else:
+            return self.zstd.compress(data)
+
+def compress_record(compressor, waveform, dtype, shape):
+    # convert a record to one chunk of the dataset, and compress it
+    waveform = np.asarray(waveform, dtype=dtype)
+    if waveform.shape != tuple(shape):
+        raise ValueError("record shape {0} does not match dataset chunk shape {1}".format(
+            waveform.shape, tuple(shape)))
+    return compressor.compress(waveform)
+
+def make_compressor(dev):
+    # the compression configured for a device, or None
+    if not dev.config["compression"]:
+        return None
+    try:
+        level = int(dev.config["compression_level"]) if dev.config["compression_level"] else None
+        return WaveformCompressor(dev.config["compression"], level, dev.config["shuffle"])
+    except ValueError as err:
+        logging.warning("Invalid compression for {0}, writing uncompressed: {1}".format(dev.config["name"], err))
+        return None
+
+class Journal:
+    """Append-only, memory-mapped log of the data and events queued for the
+    HDF writer, so that they survive a crash of the program before being
+    written to HDF.
+
+    The file starts with a header naming the HDF file and run, followed by
+    records of (length, CRC32, pickled (device name, kind, payload)), and a
+    zero length after the last record. Positions returned by mark() keep
+    counting across truncate(), which drops all records before a mark.
+    """
+    header_size = 4096
+    record_header = struct.Struct("<II")
+
+    def __init__(self, fname, hdf_fname, run_name, size=2**24):
+        self.fname = fname
+        self.lock = threading.Lock()
+
+        self.file = open(fname, "w+b")
+        self.file.truncate(self.header_size + size)
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        self.write_header(hdf_fname, run_name)
+
+        # the end of the records, and the number of bytes truncated so far
+        self.position = self.header_size
+        self.truncated = 0
+        self.terminate()
+
+    def write_header(self, hdf_fname, run_name):
+        header = pickle.dumps((hdf_fname, run_name))
+        if len(header) + 4 > self.header_size:
+            raise OSError("journal header too long")
+        self.mmap[0:4+len(header)] = struct.pack("<I", len(header)) + header
+
+    def set_target(self, hdf_fname, run_name):
+        # the HDF file and run that the records are replayed into
+        with self.lock:
+            self.write_header(hdf_fname, run_name)
+
+    def terminate(self):
+        self.mmap[self.position:self.position+self.record_header.size] = bytes(self.record_header.size)
+
+    def append(self, dev_name, kind, payload, queue):
+        """Journal the payload, and append it to the queue. The HDF writer takes
+        the queue contents and the journal mark() under the same lock, so that
+        everything journaled before a mark has been taken from the queues."""
+        try:
+            record = pickle.dumps((dev_name, kind, payload), protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as err:
+            logging.warning("Cannot journal {0} of {1}: {2}".format(kind, dev_name, err))
+            record = None
+
+        with self.lock:
+            if record and not self.mmap.closed:
+                self.write(record)
+            queue.append(payload)
+
+    def write(self, record):
+        end = self.position + self.record_header.size + len(record)
+        if end + self.record_header.size > len(self.mmap):
+            self.grow(end + self.record_header.size)
+
+        # write the record, then the terminator after it, and only then the
+        # header that makes the record valid
+        start = self.position + self.record_header.size
+        self.mmap[start:end] = record
+        self.position = end
+        self.terminate()
+        self.mmap[start-self.record_header.size:start] = self.record_header.pack(len(record), zlib.crc32(record))
+
+    def grow(self, size):
+        # mmaps cannot be resized on all platforms; remap the enlarged file
+        size = max(2*len(self.mmap), size)
+        self.mmap.close()
+        self.file.truncate(size)
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+
+    def mark(self):
+        return self.position + self.truncated
+
+    def truncate(self, mark):
+        # move the records after the mark to the start
+        with self.lock:
+            start = mark - self.truncated
+            if start <= self.header_size:
+                return
+            tail = self.mmap[start:self.position]
+            self.mmap[self.header_size:self.header_size+len(tail)] = tail
+            self.truncated += start - self.header_size
+            self.position = self.header_size + len(tail)
+            self.terminate()
+
+    def close(self, remove=True):
+        with self.lock:
+            self.mmap.close()
+            self.file.close()
+        if remove:
+            os.remove(self.fname)
+
+    @classmethod
+    def read(cls, fname):
+        """Returns the HDF filename, run name, and the valid records of a journal."""
+        with open(fname, "rb") as f:
+            buf = f.read()
+        length, = struct.unpack_from("<I", buf, 0)
+        hdf_fname, run_name = pickle.loads(buf[4:4+length])
+
+        # read records up to the terminator or the first invalid one
+        records = []
+        pos = cls.header_size
+        while pos + cls.record_header.size <= len(buf):
+            length, crc = cls.record_header.unpack_from(buf, pos)
+            record = buf[pos+cls.record_header.size:pos+cls.record_header.size+length]
+            if length == 0 or len(record) < length or zlib.crc32(record) != crc:
+                break
+            records.append(pickle.loads(record))
+            pos += cls.record_header.size + length
+        return hdf_fname, run_name, records
+
 class HDF_writer(threading.Thread):
-    def __init__(self, parent):
+    # events are stored with the command as an index into the name_events_commands
+    # dataset; rows with a NaN time are preallocated but not yet written
+    events_dtype = np.dtype([
+            ("time",         "f8"),
+            ("command",      "i4"),
+            ("return_value", h5py.special_dtype(vlen=str)),
+        ])
+
+    # fast devices writing a dataset per record list them in the name_index
+    # dataset, so that records can be found without listing the group
+    record_index_dtype = np.dtype([
+            ("record",    "i8"),
+            ("timestamp", "f8"),
+            ("dataset",   h5py.ref_dtype),
+        ])
+
+    # writers of different shards update the main HDF file
+    main_file_lock = threading.Lock()
+
+    def __init__(self, parent, filename=None, run_name=None, shard=0, dev_names=None):
         threading.Thread.__init__(self)
         self.parent = parent
         self.active = threading.Event()
 
+        # for each device, the ids of the commands and the number of events written
+        self.events_commands = {}
+        self.n_events = {}
+
+        # for each fast device writing a dataset per record, the number of records
+        self.n_records = {}
+
+        # compression of fast-device records runs on a pool of threads ahead of
+        # the writer; the compressed chunks wait in self.pending until written
+        self.compressors = {}
+        self.pending = {}
+        self.wait_for_compression = False
+
+        self.file = None
+        self.journal = None
+        self.journal_mark = None
+        self.journal_keep = False
+
+        # the devices written by this writer (all, unless sharding)
+        self.shard = shard
+        self.dev_names = dev_names if dev_names is not None else list(self.parent.devices)
+        self.time_last_loop = time.time()
+
+        # rotation into part files; self.parts holds the filenames and dataset
+        # shapes of the completed parts
+        self.part = None
+        self.parts = []
+        self.time_part_start = time.time()
+        self.part_size0 = 0
+
+        # attach to an existing run, e.g. to replay a journal into it
+        if filename:
+            self.filename = filename
+            self.run_name = run_name
+            self.swmr = False
+            return
+
         # configuration parameters
-        self.filename = self.parent.config["files"]["hdf_fname"]
-        self.parent.run_name = str(int(time.time())) + " " + self.parent.config["general"]["run_name"]
+        if not run_name:
+            run_name = str(int(time.time())) + " " + self.parent.config["general"]["run_name"]
+        self.run_name = self.parent.run_name = run_name
+        self.main_filename = self.parent.config["files"]["hdf_fname"]
+        self.rotate_size, self.rotate_time = self.rotation_limits()
+        if self.rotate_size or self.rotate_time:
+            self.part = 1
+        self.filename = self.shard_filename(self.main_filename, run_name, shard, self.part)
+
+        # whether to keep the file open for the whole run in SWMR mode
+        self.swmr = self.swmr_possible()
 
-        # create/open HDF file, groups, and datasets
-        with h5py.File(self.filename, 'a') as f:
-            root = f.create_group(self.parent.run_name)
+        try:
+            n_workers = int(self.parent.config["general"].get("hdf_compression_workers", "2"))
+        except ValueError:
+            logging.warning("Invalid hdf_compression_workers, using 2.")
+            n_workers = 2
+        self.compression_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(n_workers, 1))
+
+        self.create_file()
+        if self.part:
+            self.check_rotate_size()
+            self.part_size0 = os.path.getsize(self.filename)
+
+        # the other shards' and the parts' datasets appear in the main HDF file
+        if shard > 0 or self.part:
+            self.link_into_main_file()
+
+        if self.swmr:
+            self.start_swmr()
+
+        # write-ahead journal of the queued data and events
+        journal_fname = self.parent.config["files"].get("journal_fname", "")
+        if journal_fname and shard > 0:
+            journal_fname += ".shard" + str(shard)
+        if journal_fname:
+            try:
+                self.journal = Journal(journal_fname, self.filename, self.run_name)
+            except OSError as err:
+                logging.warning("HDF_writer: cannot open journal, running without: {0}".format(err))
+                logging.info(traceback.format_exc())
 
-            # write run attributes
-            root.attrs["time_offset"] = self.parent.config["time_offset"]
-            for key, val in self.parent.config["run_attributes"].items():
-                root.attrs[key] = val
+        # the journal position up to which everything has been written to HDF;
+        # after a failed write the journal is kept, to be replayed on the next start
+        self.journal_mark = self.journal.mark() if self.journal else None
 
-            for dev_name, dev in self.parent.devices.items():
+        self.active.set()
+
+    def create_file(self):
+        # create/open HDF file, groups, and datasets (SWMR requires the newest
+        # file format, and all objects to exist before SWMR mode is started)
+        with h5py.File(self.filename, 'a', libver='latest' if self.swmr else None) as f:
+            root = f.create_group(self.run_name)
+            self.write_run_attributes(root)
+
+            for dev_name, dev in self.devices():
                 # check device is enabled
                 if dev.config["control_params"]["enabled"]["value"] < 1:
                     continue
@@ -936,32 +2343,367 @@ class HDF_writer(threading.Thread):
                             dev.config["name"],
                             (0,),
                             maxshape=(None,),
-                            dtype=dtype
+                            dtype=dtype,
+                            chunks=chunk_shape((), dtype, dev.get_dt())
                         )
                     for attr_name, attr in dev.config["attributes"].items():
                         dset.attrs[attr_name] = attr
                 else:
                     for attr_name, attr in dev.config["attributes"].items():
                         grp.attrs[attr_name] = attr
+                    self.compressors[dev.config["name"]] = make_compressor(dev)
+                    if dev.config["fast_data_layout"] == "extendable":
+                        self.create_waveform_datasets(grp, dev)
+                    else:
+                        grp.create_dataset(dev.config["name"] + "_index", (0,),
+                                maxshape=(None,), dtype=self.record_index_dtype,
+                                chunks=chunk_shape((), self.record_index_dtype, dev.get_dt()))
+                        grp.attrs[dev.config["name"] + "_n_records"] = 0
+
+                # create datasets for events, and the commands they refer to
+                events_dset = grp.create_dataset(dev.config["name"]+"_events", (0,),
+                        maxshape=(None,), dtype=self.events_dtype)
+                grp.create_dataset(dev.config["name"]+"_events_commands", (0,),
+                        maxshape=(None,), dtype=h5py.special_dtype(vlen=str))
+
+    def file_kwargs(self):
+        # no chunk cache: HDF5 writes the appended rows of an uncompressed
+        # dataset straight to the file if the chunk doesn't fit in the cache,
+        # but otherwise reads the whole partly filled chunk (when reopening the
+        # file) and writes it all back (when closing or flushing), in each loop
+        return {"rdcc_nbytes": 0}
+
+    def write_run_attributes(self, root):
+        root.attrs["time_offset"] = self.parent.config["time_offset"]
+        for key, val in self.parent.config["run_attributes"].items():
+            root.attrs[key] = val
+
+    def devices(self):
+        for dev_name in self.dev_names:
+            yield dev_name, self.parent.devices[dev_name]
+
+    @staticmethod
+    def shard_filename(fname, run_name, shard, part=None):
+        # shard 0 writes to the main file, the others to a file for the run,
+        # e.g. test.hdf -> test_1600000000_shard1.hdf; when rotating files,
+        # all shards write to numbered parts, e.g. test_1600000000_part3.hdf
+        if shard == 0 and not part:
+            return fname
+        path = Path(fname)
+        suffix = "_shard" + str(shard) if shard > 0 else ""
+        if part:
+            suffix += "_part" + str(part)
+        return str(path.with_name("{0}_{1}{2}{3}".format(
+            path.stem, run_name.split()[0], suffix, path.suffix)))
+
+    @staticmethod
+    def assign_shards(devices, n_shards):
+        """Distributes the enabled devices over the given number of writers.
+
+        Fast devices with the default layout create datasets while running, so
+        they stay in the main file (shard 0); the other fast devices are spread
+        over the remaining shards, then the slow devices over all shards."""
+        shards = [[] for _ in range(n_shards)]
+        load = [0] * n_shards
+        enabled = [(name, dev) for name, dev in devices.items()
+                if dev.config["control_params"]["enabled"]["value"] >= 1]
+        for name, dev in sorted(enabled, key=lambda x: x[1].config["slow_data"]):
+            if dev.config["slow_data"]:
+                candidates = range(n_shards)
+            elif dev.config["fast_data_layout"] == "extendable" and n_shards > 1:
+                candidates = range(1, n_shards)
+            else:
+                candidates = [0]
+            i = min(candidates, key=lambda i: load[i])
+            shards[i].append(name)
+            load[i] += 1 if dev.config["slow_data"] else 100
+        return shards
+
+    def link_into_main_file(self, final=False):
+        """Makes the datasets of this writer's devices appear in the main HDF
+        file, in the same place as they'd be if written there.
+
+        These are external links (relative to the main file's directory) to the
+        datasets in the current file. When rotating, the data, attrs and events
+        datasets are instead virtual datasets stitching together all parts, the
+        last of them extending as it's written to unless final; the events
+        commands (which are kept for the whole run) are linked from the current
+        part, and the parts are also linked from the run's parts group."""
+        if final:
+            shapes = self.parts[-1][1]
+        else:
+            shapes = self.dataset_shapes() if self.part else {}
+
+        with HDF_writer.main_file_lock, h5py.File(self.main_filename, 'a') as f:
+            root = f.require_group(self.run_name)
+            if self.part:
+                self.write_run_attributes(root)
+                parts = root.require_group("parts")
+                for fname in [fname for fname, _ in self.parts] + [self.filename]:
+                    if Path(fname).stem not in parts:
+                        parts[Path(fname).stem] = h5py.ExternalLink(Path(fname).name, "/" + self.run_name)
+
+            for dev_name, dev in self.devices():
+                grp = root.require_group(dev.config["path"])
+                names = [dev.config["name"] + suffix for suffix in ["_events", "_events_commands"]]
+                if dev.config["slow_data"] or dev.config["fast_data_layout"] == "extendable":
+                    names.append(dev.config["name"])
+                if not dev.config["slow_data"]:
+                    names.append(dev.config["name"] + "_attrs")
+                for name in names:
+                    path = "/" + self.run_name + "/" + dev.config["path"] + "/" + name
+                    # replace the links to the previous part without resolving them
+                    if grp.get(name, getlink=True) is not None:
+                        del grp[name]
+                    if path in shapes:
+                        dset = grp.create_virtual_dataset(name, self.stitch_parts(path, shapes[path], final))
+                        if name == dev.config["name"]:
+                            for attr_name, attr in dev.config["attributes"].items():
+                                dset.attrs[attr_name] = attr
+                    else:
+                        grp[name] = h5py.ExternalLink(Path(self.filename).name, path)
+
+    def dataset_shapes(self):
+        # the shape and type of the data, attrs and events datasets in the
+        # current file, which have the same type and row shape in each part
+        shapes = {}
+        with h5py.File(self.filename, 'r') as f:
+            for dev_name, dev in self.devices():
+                for suffix in ["", "_attrs", "_events"]:
+                    path = "/" + self.run_name + "/" + dev.config["path"] + "/" + dev.config["name"] + suffix
+                    if isinstance(f.get(path), h5py.Dataset):
+                        shapes[path] = (f[path].shape, f[path].dtype)
+        return shapes
+
+    def rows_in_previous_parts(self, dev):
+        # the number of records of a fast device written to the completed parts
+        path = "/" + self.run_name + "/" + dev.config["path"] + "/" + dev.config["name"]
+        return sum(shapes[path][0][0] for fname, shapes in self.parts if path in shapes)
+
+    def stitch_parts(self, path, shape, final):
+        # map the rows of each completed part one after the other, followed by
+        # all rows of the current part, however many there will be
+        shape, dtype = shape
+        row_shape = shape[1:]
+        sizes = [(fname, part_shapes[path][0][0]) for fname, part_shapes in self.parts
+                if path in part_shapes]
+        layout = h5py.VirtualLayout(
+                shape    = (sum(n for _, n in sizes),) + row_shape,
+                maxshape = (None,) + row_shape,
+                dtype    = dtype,
+            )
+        offset = 0
+        for fname, n in sizes:
+            if n > 0:
+                layout[offset:offset+n] = h5py.VirtualSource(Path(fname).name, path, shape=(n,)+row_shape)
+                offset += n
+        if not final:
+            source = h5py.VirtualSource(Path(self.filename).name, path, shape=shape,
+                    maxshape=(None,)+row_shape)
+            layout[offset:h5py.h5s.UNLIMITED] = source[0:h5py.h5s.UNLIMITED]
+        return layout
+
+    def rotation_limits(self):
+        # the file size (in bytes) and time (in seconds) after which to roll
+        # over to a new part file; 0 for no limit
+        limits = []
+        for key, unit in [("hdf_rotate_mb", 1e6), ("hdf_rotate_minutes", 60)]:
+            try:
+                limits.append(max(float(self.parent.config["general"].get(key, "0") or "0"), 0) * unit)
+            except ValueError:
+                logging.warning("Invalid {0}, not rotating HDF files on it.".format(key))
+                limits.append(0)
+        if not any(limits):
+            return 0, 0
+
+        # the datasets created for each acquisition cannot be stitched together
+        for dev_name, dev in self.devices():
+            if dev.config["control_params"]["enabled"]["value"] < 1 or dev.config["slow_data"]:
+                continue
+            if dev.config["fast_data_layout"] != "extendable":
+                logging.warning("HDF_writer: cannot rotate HDF files with fast device " + dev_name
+                        + ", which does not use the extendable layout.")
+                return 0, 0
 
-                # create dataset for events
-                events_dset = grp.create_dataset(dev.config["name"]+"_events", (0,3),
-                        maxshape=(None,3), dtype=h5py.special_dtype(vlen=str))
+        return tuple(limits)
 
-        self.active.set()
+    def rotation_due(self):
+        if not self.part:
+            return False
+        if self.rotate_time and time.time() - self.time_part_start >= self.rotate_time:
+            return True
+        # the size of the data written to the part, not counting the file's
+        # initial size
+        return bool(self.rotate_size) and \
+                os.path.getsize(self.filename) - self.part_size0 >= self.rotate_size
+
+    def check_rotate_size(self):
+        # HDF5 allocates whole chunks (of up to about 1 MB, see chunk_shape()),
+        # so a part grows by a chunk per dataset as soon as it's written to; a
+        # smaller limit would roll over to a new part in every loop
+        allocation = 0
+        with h5py.File(self.filename, 'r') as f:
+            def add_chunk(name, obj):
+                nonlocal allocation
+                if isinstance(obj, h5py.Dataset) and obj.chunks:
+                    allocation += int(np.prod(obj.chunks)) * obj.dtype.itemsize
+            f.visititems(add_chunk)
+        if self.rotate_size and self.rotate_size < 2*allocation:
+            logging.warning("HDF_writer: hdf_rotate_mb = {0:g} is less than two chunks per dataset, "
+                    "using {1:g} instead.".format(self.rotate_size/1e6, 2*allocation/1e6))
+            self.rotate_size = 2*allocation
+
+    def rotate(self):
+        # complete the current part, including the records being compressed
+        self.wait_for_compression = True
+        try:
+            with self.open_file() as fname:
+                mark = self.write_all_queues_to_HDF(fname)
+                self.trim_events(fname)
+        finally:
+            self.wait_for_compression = False
+        self.truncate_journal(mark)
+        self.parts.append((self.filename, self.dataset_shapes()))
+
+        # continue the run in the next part; the command ids are kept for the
+        # whole run, so that the stitched events refer to a single table
+        self.part += 1
+        self.filename = self.shard_filename(self.main_filename, self.run_name, self.shard, self.part)
+        self.create_file()
+        self.copy_events_commands()
+        self.link_into_main_file()
+        self.time_part_start = time.time()
+        self.part_size0 = os.path.getsize(self.filename)
+        if self.journal:
+            self.journal.set_target(self.filename, self.run_name)
+        logging.info("HDF_writer: continuing run " + self.run_name + " in " + self.filename)
+
+    def copy_events_commands(self):
+        # list the commands so far in the new part, and start its events afresh
+        with h5py.File(self.filename, 'a') as f:
+            root = f[self.run_name]
+            for name, commands in self.events_commands.items():
+                dev = self.parent.devices[name]
+                commands_dset = root[dev.config["path"]][name + "_events_commands"]
+                commands_dset.resize(len(commands), axis=0)
+                if commands:
+                    commands_dset[:] = sorted(commands, key=commands.get)
+                self.n_events[name] = 0
+
+    def swmr_possible(self):
+        if not self.parent.config["general"].get("hdf_swmr", "False") in ["1", "True"]:
+            return False
+
+        # readers follow the external links from the main file without SWMR
+        if self.parent.ControlGUI.n_HDF_shards() > 1:
+            logging.warning("HDF_writer: SWMR mode not possible with several writer shards.")
+            return False
+        if self.part:
+            logging.warning("HDF_writer: SWMR mode not possible when rotating HDF files.")
+            return False
+
+        # no new datasets can be created in SWMR mode, but fast devices with
+        # the default layout create one for each acquisition
+        for dev_name, dev in self.devices():
+            if dev.config["control_params"]["enabled"]["value"] < 1 or dev.config["slow_data"]:
+                continue
+            if dev.config["fast_data_layout"] != "extendable":
+                logging.warning("HDF_writer: SWMR mode not possible with fast device " + dev_name
+                        + ", reopening the file in each loop instead.")
+                return False
+
+        return True
+
+    def create_waveform_datasets(self, grp, dev):
+        # chunks compressed by the pool are written directly
+        compressor = self.compressors.get(dev.config["name"])
+        if compressor and compressor.direct:
+            self.pending[dev.config["name"]] = deque()
+
+        # one (records, channels, samples) dataset, extended with each record
+        shape = tuple(int(x) for x in dev.config["shape"])[1:]
+        dset = grp.create_dataset(
+                dev.config["name"],
+                (0,) + shape,
+                maxshape = (None,) + shape,
+                chunks   = (1,) + shape,
+                dtype    = dev.config["dtype"],
+                **(compressor.dataset_kwargs() if compressor else {})
+            )
+        for attr_name, attr in dev.config["attributes"].items():
+            dset.attrs[attr_name] = attr
+
+        # per-record metadata (the attributes returned by the driver)
+        attrs_dtype = np.dtype([
+                ("record",    "i8"),
+                ("timestamp", "f8"),
+                ("attrs",     h5py.special_dtype(vlen=str)),
+            ])
+        grp.create_dataset(
+                dev.config["name"] + "_attrs",
+                (0,),
+                maxshape = (None,),
+                dtype    = attrs_dtype,
+                chunks   = chunk_shape((), attrs_dtype, dev.get_dt()),
+            )
+
+    def start_swmr(self):
+        # wait for any readers to close the file before switching it to SWMR mode
+        with swmr_lock:
+            try:
+                self.file = h5py.File(self.filename, 'a', libver='latest', **self.file_kwargs())
+                self.file.swmr_mode = True
+            # a file created with an older file format keeps its superblock
+            # version even when reopened with libver='latest', and h5py then
+            # refuses SWMR mode with a RuntimeError
+            except (OSError, ValueError, RuntimeError) as err:
+                logging.warning("HDF_writer: cannot start SWMR mode, reopening the file"
+                        + " in each loop instead: {0}".format(err))
+                logging.info(traceback.format_exc())
+                if self.file:
+                    self.file.close()
+                self.file = None
+                self.swmr = False
+                return
+            swmr_files[self.filename] = self.run_name
+
+    def stop_swmr(self):
+        with swmr_lock:
+            swmr_files.pop(self.filename, None)
+            close_swmr_reader(self.filename)
+            self.file.close()
+            self.file = None
+
+    @contextlib.contextmanager
+    def open_file(self):
+        # in SWMR mode the file stays open and is flushed after each write, so
+        # that readers see the new data
+        if self.file:
+            yield self.file
+            self.file.flush()
+        else:
+            with h5py.File(self.filename, 'a', **self.file_kwargs()) as f:
+                yield f
 
     def run(self):
         while self.active.is_set():
             # update the label that shows the time this loop last ran
-            self.parent.ControlGUI.HDF_status.setText(str(time.time()))
+            self.time_last_loop = time.time()
+            self.parent.ControlGUI.update_HDF_status()
 
             # empty queues to HDF
             try:
-                with h5py.File(self.filename, 'a') as fname:
-                    self.write_all_queues_to_HDF(fname)
+                with self.open_file() as fname:
+                    mark = self.write_all_queues_to_HDF(fname)
+                self.truncate_journal(mark)
+
+                # roll over to a new part file
+                if self.rotation_due():
+                    self.rotate()
             except OSError as err:
                 logging.warning("HDF_writer error: {0}".format(err))
                 logging.info(traceback.format_exc())
+                self.keep_journal()
 
             # loop delay
             try:
@@ -975,86 +2717,324 @@ class HDF_writer(threading.Thread):
                 time.sleep(float(self.parent.config["general"]["default_hdf_dt"]))
 
         # make sure everything is written to HDF when the thread terminates
+        self.wait_for_compression = True
         try:
-            with h5py.File(self.filename, 'a') as fname:
+            with self.open_file() as fname:
                 self.write_all_queues_to_HDF(fname)
+                self.trim_events(fname)
+
+            # the virtual datasets stitch the parts as they are now
+            if self.part:
+                self.parts.append((self.filename, self.dataset_shapes()))
+                self.link_into_main_file(final=True)
         except OSError as err:
             logging.warning("HDF_writer error: ", err)
             logging.warning(traceback.format_exc())
+            self.keep_journal()
+        finally:
+            self.compression_pool.shutdown(wait=True)
+            if self.file:
+                self.stop_swmr()
+            if self.journal:
+                self.journal.close(remove = not self.journal_keep)
+
+    def truncate_journal(self, mark):
+        if not self.journal or self.journal_keep:
+            return
 
-    def write_all_queues_to_HDF(self, fname):
-            root = fname.require_group(self.parent.run_name)
-            for dev_name, dev in self.parent.devices.items():
-                # check device has had control started
-                if not dev.control_started:
+        # records still being compressed were journaled after the mark that
+        # was current when they were taken from the queue
+        marks = [pending[0][2] for pending in self.pending.values() if pending]
+        self.journal.truncate(min(marks + [mark]))
+
+    def keep_journal(self):
+        if self.journal and not self.journal_keep:
+            logging.warning("HDF_writer: keeping the journal " + self.journal.fname
+                    + " to replay it when the program is started again.")
+            self.journal_keep = True
+
+    def replay_journal(self, records):
+        """Writes journaled records to the run, the events and then the data of
+        each device. Returns the records that were not written (of unknown
+        devices, or whose write failed), in their journal order."""
+        # collect the data and events of each device, in order
+        queued = {}
+        for i, (dev_name, kind, payload) in enumerate(records):
+            queued.setdefault(dev_name, ([], []))[0 if kind == "event" else 1].append(i)
+
+        not_replayed = []
+        with h5py.File(self.filename, 'a') as fname:
+            root = fname[self.run_name]
+            for dev_name, (events, data) in queued.items():
+                dev = self.parent.devices.get(dev_name)
+                if not dev:
+                    logging.warning("Cannot replay journal for unknown device " + dev_name)
+                    not_replayed += events + data
                     continue
+                for write, indices in [(self.append_events, events), (self.write_data, data)]:
+                    if not indices:
+                        continue
+                    try:
+                        write(root[dev.config["path"]], dev, [records[i][2] for i in indices])
+                    except Exception as err:
+                        logging.warning("Cannot replay journal for {0}: {1}".format(dev_name, err))
+                        logging.warning(traceback.format_exc())
+                        not_replayed += indices
+            self.trim_events(fname)
+        return [records[i] for i in sorted(not_replayed)]
 
-                # check writing to HDF is enabled for this device
-                if not dev.config["control_params"]["HDF_enabled"]["value"]:
-                    continue
+    def write_all_queues_to_HDF(self, fname):
+            root = fname.require_group(self.run_name)
+
+            # take everything queued so far, and the journal position up to
+            # which it has been journaled (devices journal and queue atomically)
+            with self.journal.lock if self.journal else contextlib.nullcontext():
+                queued = {}
+                for dev_name, dev in self.devices():
+                    # check device has had control started
+                    if not dev.control_started:
+                        continue
 
-                # get events, if any, and write them to HDF
-                events = self.get_data(dev.events_queue)
-                if len(events) != 0:
-                    grp = root.require_group(dev.config["path"])
-                    events_dset = grp[dev.config["name"] + "_events"]
-                    events_dset.resize(events_dset.shape[0]+len(events), axis=0)
-                    events_dset[-len(events):,:] = events
-
-                # get data
-                data = self.get_data(dev.data_queue)
-                if len(data) == 0:
-                    continue
+                    # check writing to HDF is enabled for this device
+                    if not dev.config["control_params"]["HDF_enabled"]["value"]:
+                        continue
 
+                    queued[dev_name] = (self.get_data(dev.events_queue), self.get_data(dev.data_queue))
+                mark = self.journal.mark() if self.journal else None
+
+            for dev_name, (events, data) in queued.items():
+                dev = self.parent.devices[dev_name]
                 grp = root.require_group(dev.config["path"])
 
-                # if writing all data from a single device to one dataset
-                if dev.config["slow_data"]:
-                    dset = grp[dev.config["name"]]
-                    # check if one queue entry has multiple rows
-                    if np.shape(data)[0] >= 2:
-                        list_len = len(data)
-                        dset.resize(dset.shape[0]+list_len, axis=0)
-                        # iterate over queue entries with multiple rows and append
-                        for idx, d in enumerate(data):
-                            idx_start = -list_len + idx
-                            idx_stop = -list_len+idx+1
-                            try:
-                                d = np.array([tuple(d)], dtype = dset.dtype)
-                                if idx_stop == 0:
-                                    dset[idx_start:] = d
-                                else:
-                                    dset[idx_start:idx_stop] = d
-                            except Exception as err:
-                                logging.error(f"Error in write_all_queues_to_HDF: {dev_name}; {str(err)}")
-                    else:
-                        dset.resize(dset.shape[0]+len(data), axis=0)
-                        try:
-                            data = np.array([tuple(data[0])], dtype = dset.dtype)
-                            dset[-len(data):] = data
-                        except (ValueError, TypeError) as err:
-                            logging.error("Error in write_all_queues_to_HDF(): "+f"{dev_name}; " + str(err))
-                            logging.error(traceback.format_exc())
-
-                # if writing each acquisition record to a separate dataset
-                else:
-                    # check it is not a NaN return
-                    if data==[np.nan] or data==np.nan:
-                        continue
+                # write events, if any, to HDF
+                if len(events) != 0:
+                    self.append_events(grp, dev, events)
 
-                    # parse and write the data
-                    for record, all_attrs in data:
-                        for waveforms, attrs in zip(record, all_attrs):
-                            # data
-                            dset = grp.create_dataset(
-                                    name        = dev.config["name"] + "_" + str(len(grp)),
-                                    data        = waveforms.T,
-                                    dtype       = dev.config["dtype"],
-                                    compression = None
-                                )
-                            # metadata
-                            for key, val in attrs.items():
-                                dset.attrs[key] = val
+                # write records that have been compressed since the last loop
+                if self.pending.get(dev_name):
+                    self.write_compressed(grp, dev)
+
+                # write data
+                if len(data) != 0:
+                    self.write_data(grp, dev, data)
+
+            # records taken from the queues in this loop are journaled before mark
+            self.journal_mark = mark
+            return mark
+
+    def write_data(self, grp, dev, data):
+        dev_name = dev.config["name"]
+
+        # if writing all data from a single device to one dataset
+        if dev.config["slow_data"]:
+            dset = grp[dev.config["name"]]
+
+            # convert all queue entries at once, and append them with
+            # a single write
+            data = rows_to_structured_array(data, dset.dtype, dev_name)
+            if len(data) == 0:
+                return
+            dset.resize(dset.shape[0]+len(data), axis=0)
+            dset[-len(data):] = data
+
+        # if writing each acquisition record to a separate dataset
+        else:
+            # check it is not a NaN return
+            if data==[np.nan] or data==np.nan:
+                return
+
+            # append all records to a single dataset
+            if dev.config["fast_data_layout"] == "extendable":
+                try:
+                    self.append_waveforms(grp, dev, data)
+                except (ValueError, TypeError) as err:
+                    logging.error("Error in write_all_queues_to_HDF(): "+f"{dev_name}; " + str(err))
+                    logging.error(traceback.format_exc())
+                return
+
+            # parse and write the data, numbering the records with a counter
+            # kept in memory and in the name_n_records group attribute
+            compressor = self.compressors.get(dev_name)
+            n_records = self.n_records.get(dev_name)
+            if n_records is None:
+                n_records = int(grp.attrs.get(dev_name + "_n_records", 0))
+                # skip any records written after the attribute (e.g. before a crash)
+                while dev_name + "_" + str(n_records) in grp:
+                    n_records += 1
+            index_rows = []
+            for record, all_attrs in data:
+                for waveforms, attrs in zip(record, all_attrs):
+                    # data (when replaying a journal at startup, the device
+                    # isn't connected yet and its dtype isn't known)
+                    dset = grp.create_dataset(
+                            name        = dev_name + "_" + str(n_records),
+                            data        = waveforms.T,
+                            dtype       = dev.config.get("dtype", waveforms.dtype),
+                            **(compressor.dataset_kwargs() if compressor else {})
+                        )
+                    # metadata
+                    for key, val in attrs.items():
+                        dset.attrs[key] = val
+                    index_rows.append((n_records, record_timestamp(attrs), dset.ref))
+                    n_records += 1
+
+            # list the new records in the index with a single write
+            if index_rows:
+                index = grp[dev_name + "_index"]
+                index.resize(index.shape[0]+len(index_rows), axis=0)
+                index[-len(index_rows):] = np.array(index_rows, dtype=self.record_index_dtype)
+            grp.attrs[dev_name + "_n_records"] = self.n_records[dev_name] = n_records
+
+    def append_events(self, grp, dev, events):
+        name = dev.config["name"]
+
+        # when appending to an existing run (e.g. replaying a journal), continue
+        # after the last event written, and with the commands listed so far
+        dset = grp[name + "_events"]
+        if name not in self.n_events:
+            written = np.flatnonzero(~np.isnan(dset["time"])) if dset.shape[0] else []
+            self.n_events[name] = int(written[-1]) + 1 if len(written) else 0
+            self.events_commands[name] = {
+                    (c.decode() if isinstance(c, bytes) else c) : i
+                    for i, c in enumerate(grp[name + "_events_commands"][()])
+                }
+
+        # replace the commands by their ids, adding new commands to the table
+        commands = self.events_commands[name]
+        new_commands, rows = [], []
+        for t, command, ret_val in events:
+            command = str(command)
+            if command not in commands:
+                commands[command] = len(commands)
+                new_commands.append(command)
+            rows.append((t, commands[command], str(ret_val)))
+        if new_commands:
+            commands_dset = grp[name + "_events_commands"]
+            commands_dset.resize(len(commands), axis=0)
+            commands_dset[-len(new_commands):] = new_commands
+
+        # grow the dataset geometrically rather than with each write
+        n = self.n_events[name]
+        if n + len(rows) > dset.shape[0]:
+            capacity = max(2*dset.shape[0], n + len(rows), 64)
+            dset.resize(capacity, axis=0)
+            fill = np.zeros(capacity - n - len(rows), dtype=self.events_dtype)
+            fill["time"] = np.nan
+            fill["command"] = -1
+            fill["return_value"] = ""
+            dset[n+len(rows):] = fill
+        dset[n:n+len(rows)] = np.array(rows, dtype=self.events_dtype)
+        self.n_events[name] = n + len(rows)
+
+    def trim_events(self, fname):
+        # remove the preallocated rows at the end of the run
+        root = fname.require_group(self.run_name)
+        for dev_name, n in self.n_events.items():
+            dev = self.parent.devices[dev_name]
+            root[dev.config["path"]][dev.config["name"] + "_events"].resize(n, axis=0)
+
+    def append_waveforms(self, grp, dev, data):
+        waveforms, all_attrs = [], []
+        for record, record_attrs in data:
+            waveforms.extend(record)
+            all_attrs.extend(record_attrs)
+
+        # drop records that don't fit the dataset before resizing it, so that
+        # no rows are left unwritten and the records and attrs stay aligned
+        dset = grp[dev.config["name"]]
+        waveforms, all_attrs = self.check_records(dset, dev, waveforms, all_attrs)
+        if not waveforms:
+            return
+
+        # hand the records to the compression pool; they're written by
+        # write_compressed() once compressed
+        if dev.config["name"] in self.pending:
+            compressor = self.compressors[dev.config["name"]]
+            for waveform, attrs in zip(waveforms, all_attrs):
+                future = self.compression_pool.submit(
+                        compress_record, compressor, waveform, dset.dtype, dset.chunks[1:])
+                # until written, keep the records journaled after the previous loop
+                self.pending[dev.config["name"]].append((future, attrs, self.journal_mark))
+            self.write_compressed(grp, dev)
+            return
+
+        # data
+        n0 = dset.shape[0]
+        dset.resize(n0 + len(waveforms), axis=0)
+        # decided by the dataset itself, since a writer attached to an existing
+        # run (e.g. to replay a journal) hasn't made compressors
+        if dset.id.get_create_plist().get_nfilters() == 0:
+            self.write_raw_chunks(dset, n0, waveforms)
+        else:
+            # filters applied by HDF5 (e.g. gzip or lzf)
+            dset[n0:] = np.stack(waveforms)
+        self.append_waveform_attrs(grp, dev, n0, all_attrs)
+
+    def check_records(self, dset, dev, waveforms, all_attrs):
+        # the records of the dataset's (channels, samples) shape, and of a type
+        # that can be cast to its dtype, with their attrs
+        valid = ([], [])
+        for waveform, attrs in zip(waveforms, all_attrs):
+            waveform = np.asarray(waveform)
+            if waveform.shape != dset.shape[1:]:
+                logging.error("Dropping record of {0}: shape {1} does not match dataset shape {2}".format(
+                        dev.config["name"], waveform.shape, dset.shape[1:]))
+            elif not np.can_cast(waveform.dtype, dset.dtype, casting="same_kind"):
+                logging.error("Dropping record of {0}: dtype {1} does not match dataset dtype {2}".format(
+                        dev.config["name"], waveform.dtype, dset.dtype))
+            else:
+                valid[0].append(waveform)
+                valid[1].append(attrs)
+        return valid
+
+    def write_raw_chunks(self, dset, n0, waveforms):
+        # without filters, a chunk on disk is just the record's bytes; records
+        # already of the dataset's type and (channels, samples) layout (e.g. the
+        # int16 records of the PXIe5171, views of the buffer filled by the
+        # digitizer) are written from where they are, without any copies
+        for i, waveform in enumerate(waveforms):
+            chunk = np.ascontiguousarray(waveform, dtype=dset.dtype)
+            dset.id.write_direct_chunk((n0+i,) + (0,)*(dset.ndim-1), chunk)
+
+    def write_compressed(self, grp, dev):
+        # take the compressed records in order, up to the first one that is
+        # not ready (unless stopping), so that compression never blocks writing
+        pending = self.pending[dev.config["name"]]
+        chunks, all_attrs = [], []
+        while pending and (self.wait_for_compression or pending[0][0].done()):
+            future, attrs, mark = pending.popleft()
+            try:
+                chunks.append(future.result())
+                all_attrs.append(attrs)
+            except (ValueError, TypeError) as err:
+                logging.error("Error compressing record of {0}: {1}".format(dev.config["name"], err))
+                logging.info(traceback.format_exc())
+        if not chunks:
+            return
+
+        # write the chunks as they are, bypassing the HDF5 filter pipeline
+        dset = grp[dev.config["name"]]
+        n0 = dset.shape[0]
+        dset.resize(n0 + len(chunks), axis=0)
+        for i, chunk in enumerate(chunks):
+            dset.id.write_direct_chunk((n0+i,) + (0,)*(dset.ndim-1), chunk)
+        self.append_waveform_attrs(grp, dev, n0, all_attrs)
+
+    def append_waveform_attrs(self, grp, dev, n0, all_attrs):
+        # metadata; records are numbered across all parts
+        n0 += self.rows_in_previous_parts(dev)
+        rows = []
+        for i, attrs in enumerate(all_attrs):
+            rows.append((
+                    n0 + i,
+                    record_timestamp(attrs),
+                    json.dumps(attrs, default=to_json),
+                ))
+        if not rows:
+            return
+        attrs_dset = grp[dev.config["name"] + "_attrs"]
+        attrs_dset.resize(attrs_dset.shape[0] + len(rows), axis=0)
+        attrs_dset[-len(rows):] = np.array(rows, dtype=attrs_dset.dtype)
 
     def get_data(self, fifo):
         data = []
@@ -1302,6 +3282,11 @@ class DeviceConfig(Config):
                 "dtype"              : str,
                 "shape"              : list,
                 "plots_fn"           : str,
+                "fast_data_layout"   : str,
+                "compression"        : str,
+                "compression_level"  : str,
+                "shuffle"            : bool,
+                "telemetry_dt"       : float,
             }
 
         # list of keys permitted for runtime data (which cannot be written to .ini file)
@@ -1328,6 +3313,11 @@ class DeviceConfig(Config):
         self["double_connect_dev"] = True
         self["compound_dataset"] = False
         self["plots_fn"] = "2*y"
+        self["fast_data_layout"] = "datasets"
+        self["compression"] = ""
+        self["compression_level"] = ""
+        self["shuffle"] = True
+        self["telemetry_dt"] = 0
 
     def change_param(self, key, val, sect=None, sub_ctrl=None, row=None,
             nonTriState=False, GUI_element=None):
@@ -1516,6 +3506,7 @@ class DeviceConfig(Config):
                         "rowspan"            : int(params[c].get("rowspan")),
                         "colspan"            : int(params[c].get("colspan")),
                         "monitoring_command" : params[c]["monitoring_command"],
+                        "poll_interval"      : float(params[c].get("poll_interval") or 0),
                         "return_values"      : split(params[c]["return_values"]),
                         "texts"              : split(params[c]["texts"]),
                         "states"             : split(params[c]["states"]),
@@ -1533,6 +3524,7 @@ class DeviceConfig(Config):
                         "align"      : params[c].get("align"),
                         "tooltip"    : params[c].get("tooltip"),
                         "monitoring_command" : params[c]["monitoring_command"],
+                        "poll_interval"      : float(params[c].get("poll_interval") or 0),
                         "action_commands"    : split(params[c]["action_commands"]),
                         "return_values"      : split(params[c]["return_values"]),
                         "checked"            : [True if x in ["1", "True"] else False for x in split(params[c]["checked"])],
@@ -1550,6 +3542,7 @@ class DeviceConfig(Config):
                         "value"      : params[c]["value"],
                         "tooltip"    : params[c].get("tooltip"),
                         "monitoring_command" : params[c]["monitoring_command"],
+                        "poll_interval"      : float(params[c].get("poll_interval") or 0),
                     }
 
             elif params[c].get("type") == "dummy":
@@ -1609,6 +3602,9 @@ class DeviceConfig(Config):
                 config[c_name]["col_labels"]  = ", ".join([x for x_name,x in c["col_labels"].items()])
                 config[c_name]["col_types"]   = ", ".join([x for x_name,x in c["col_types"].items()])
                 config[c_name]["col_options"] = "; ".join([", ".join(x) for x_name,x in c["col_options"].items()])
+            if c["type"] in ["indicator", "indicator_button", "indicator_lineedit"]:
+                if c.get("poll_interval"):
+                    config[c_name]["poll_interval"] = str(c["poll_interval"])
             if c["type"] == "indicator":
                 config[c_name]["monitoring_command"] = str(c.get("monitoring_command"))
                 config[c_name]["return_values"] = ", ".join(c["return_values"])
@@ -2037,14 +4033,63 @@ class ControlGUI(qt.QWidget):
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
+        self.scheduler = None
+        self.influxdb_sink = None
+        self.HDF_writers = []
         self.make_devices()
         self.place_GUI_elements()
         self.place_device_controls()
+        self.replay_journal()
 
     def update_style(self, ind):
         ind.style().unpolish(ind)
         ind.style().polish(ind)
 
+    def n_HDF_shards(self):
+        try:
+            return max(int(self.parent.config["general"].get("hdf_writer_shards", "1")), 1)
+        except ValueError:
+            logging.warning("Invalid hdf_writer_shards, using a single HDF writer.")
+            return 1
+
+    def update_HDF_status(self):
+        # the time of the last loop of the slowest HDF writer
+        if self.HDF_writers:
+            self.HDF_status.setText(str(min(w.time_last_loop for w in self.HDF_writers)))
+
+    def replay_journal(self):
+        # write data left in the HDF writers' journals by a crash to the HDF files
+        fname = self.parent.config["files"].get("journal_fname", "")
+        if not fname:
+            return
+        shard_fnames = [f for f in glob.glob(glob.escape(fname) + ".shard*") if re.search(r"\.shard\d+$", f)]
+        for journal_fname in [fname] + sorted(shard_fnames):
+            if not os.path.exists(journal_fname):
+                continue
+            try:
+                hdf_fname, run_name, records = Journal.read(journal_fname)
+                if records:
+                    logging.warning("Replaying {0} journaled records into {1}, run {2}".format(
+                            len(records), hdf_fname, run_name))
+                    records = HDF_writer(self.parent, hdf_fname, run_name).replay_journal(records)
+                if records:
+                    # keep only the records not written, out of the way of the
+                    # next run, so that replaying them later doesn't duplicate
+                    # the others
+                    kept_fname = journal_fname + "." + str(int(time.time()))
+                    logging.warning("{0} journaled records not replayed, kept in {1}".format(
+                            len(records), kept_fname))
+                    kept = Journal(kept_fname, hdf_fname, run_name)
+                    for dev_name, kind, payload in records:
+                        kept.append(dev_name, kind, payload, [])
+                    kept.close(remove=False)
+                os.remove(journal_fname)
+            except Exception as err:
+                # keep the journal, but out of the way of the next run
+                logging.warning("Cannot replay journal {0}: {1}".format(journal_fname, err))
+                logging.warning(traceback.format_exc())
+                os.replace(journal_fname, journal_fname + "." + str(int(time.time())))
+
     def make_devices(self):
         self.parent.devices = {}
 
@@ -2314,6 +4359,12 @@ class ControlGUI(qt.QWidget):
         gen_f.addWidget(self.free_qpb, 2, 1, 1, 2)
         self.check_free_disk_space()
 
+        # CPU usage of the whole program, and how devices are scheduled
+        gen_f.addWidget(qt.QLabel("CPU usage:"), 3, 0)
+        self.cpu_usage = qt.QLabel("N/A")
+        self.cpu_usage.setToolTip("Process CPU usage (100% = one core) and device threading mode.")
+        gen_f.addWidget(self.cpu_usage, 3, 1, 1, 2)
+
         gen_f.addWidget(qt.QLabel("Loop delay [s]:"), 0, 0)
         qle = qt.QLineEdit()
         qle.setText(self.parent.config["general"]["monitoring_dt"])
@@ -2328,7 +4379,7 @@ class ControlGUI(qt.QWidget):
         qch = qt.QCheckBox("InfluxDB")
         qch.setToolTip("InfluxDB enabled")
         qch.setTristate(False)
-        qch.setChecked(True if self.parent.config["influxdb"]["enabled"] in ["1", "True"] else False)
+        qch.setChecked(is_enabled(self.parent.config["influxdb"]["enabled"]))
         qch.stateChanged[int].connect(
                 lambda val: self.parent.config.change("influxdb", "enabled", val)
             )
@@ -2904,19 +4955,61 @@ class ControlGUI(qt.QWidget):
                     alignment = PyQt5.QtCore.Qt.AlignLeft,
                 )
 
+            # wake-to-dispatch latency (mean / max)
+            df.addWidget(
+                    qt.QLabel("Wake latency:"),
+                    2, 0,
+                    alignment = PyQt5.QtCore.Qt.AlignRight,
+                )
+            dev.config["monitoring_GUI_elements"]["wake_latency"] = qt.QLabel("N/A")
+            dev.config["monitoring_GUI_elements"]["wake_latency"].setToolTip(
+                    "Mean / max time from queueing a command (or ReadValue() becoming due) to dispatching it.")
+            df.addWidget(
+                    dev.config["monitoring_GUI_elements"]["wake_latency"],
+                    2, 1,
+                    alignment = PyQt5.QtCore.Qt.AlignLeft,
+                )
+
+            # CPU time spent in the device main loop
+            df.addWidget(
+                    qt.QLabel("CPU usage:"),
+                    3, 0,
+                    alignment = PyQt5.QtCore.Qt.AlignRight,
+                )
+            dev.config["monitoring_GUI_elements"]["cpu_usage"] = qt.QLabel("N/A")
+            df.addWidget(
+                    dev.config["monitoring_GUI_elements"]["cpu_usage"],
+                    3, 1,
+                    alignment = PyQt5.QtCore.Qt.AlignLeft,
+                )
+
+            # timing of the slowest driver call, the loop jitter, and the full
+            # metrics in the tooltip
+            df.addWidget(
+                    qt.QLabel("Timing:"),
+                    4, 0,
+                    alignment = PyQt5.QtCore.Qt.AlignRight,
+                )
+            dev.config["monitoring_GUI_elements"]["timing"] = qt.QLabel("N/A")
+            df.addWidget(
+                    dev.config["monitoring_GUI_elements"]["timing"],
+                    4, 1, 1, 2,
+                    alignment = PyQt5.QtCore.Qt.AlignLeft,
+                )
+
             # column names
             dev.col_names_list = split(dev.config["attributes"]["column_names"])
             dev.column_names = "\n".join(dev.col_names_list)
             dev.config["monitoring_GUI_elements"]["col_names"] = qt.QLabel(
                     dev.column_names, alignment = PyQt5.QtCore.Qt.AlignRight
                 )
-            df.addWidget(dev.config["monitoring_GUI_elements"]["col_names"], 2, 0)
+            df.addWidget(dev.config["monitoring_GUI_elements"]["col_names"], 5, 0)
 
             # data
             dev.config["monitoring_GUI_elements"]["data"] = qt.QLabel("(no data)")
             df.addWidget(
                     dev.config["monitoring_GUI_elements"]["data"],
-                    2, 1,
+                    5, 1,
                     alignment = PyQt5.QtCore.Qt.AlignLeft,
                 )
 
@@ -2924,19 +5017,19 @@ class ControlGUI(qt.QWidget):
             units = split(dev.config["attributes"]["units"])
             dev.units = "\n".join(units)
             dev.config["monitoring_GUI_elements"]["units"] = qt.QLabel(dev.units)
-            df.addWidget(dev.config["monitoring_GUI_elements"]["units"], 2, 2, alignment = PyQt5.QtCore.Qt.AlignLeft)
+            df.addWidget(dev.config["monitoring_GUI_elements"]["units"], 5, 2, alignment = PyQt5.QtCore.Qt.AlignLeft)
 
             # latest event / command sent to device & its return value
             df.addWidget(
                     qt.QLabel("Last event:"),
-                    3, 0,
+                    6, 0,
                     alignment = PyQt5.QtCore.Qt.AlignRight,
                 )
             dev.config["monitoring_GUI_elements"]["events"] = qt.QLabel("(no events)")
             dev.config["monitoring_GUI_elements"]["events"].setWordWrap(True)
             df.addWidget(
                     dev.config["monitoring_GUI_elements"]["events"],
-                    3, 1, 1, 2,
+                    6, 1, 1, 2,
                     alignment = PyQt5.QtCore.Qt.AlignLeft,
                 )
 
@@ -3106,15 +5199,53 @@ class ControlGUI(qt.QWidget):
         self.devices_frame.clear()
         self.place_device_controls()
 
-        # start the thread that writes to HDF
-        self.HDF_writer = HDF_writer(self.parent)
-        self.HDF_writer.start()
+        # start the thread that writes to InfluxDB, which also takes the
+        # telemetry of the devices whose drivers provide it
+        self.influxdb_sink = InfluxDBSink(self.parent.config["influxdb"])
+        self.influxdb_sink.active.set()
+        self.influxdb_sink.start()
+        if is_enabled(self.parent.config["influxdb"]["enabled"]):
+            for dev_name, dev in self.parent.devices.items():
+                dev.influxdb_sink = self.influxdb_sink
+
+        # start the threads that write to HDF (one, unless splitting the devices
+        # over several files; the writers still take turns in h5py, so this
+        # doesn't add throughput)
+        n_shards = self.n_HDF_shards()
+        self.HDF_writers = []
+        run_name = None
+        for shard, dev_names in enumerate(HDF_writer.assign_shards(self.parent.devices, n_shards)):
+            writer = HDF_writer(self.parent, run_name=run_name, shard=shard, dev_names=dev_names)
+            run_name = writer.run_name
+            self.HDF_writers.append(writer)
+            for dev_name in dev_names:
+                self.parent.devices[dev_name].journal = writer.journal
+        for writer in self.HDF_writers:
+            writer.start()
+
+        # number of worker threads shared by the devices (0 = one thread per device)
+        try:
+            n_workers = int(self.parent.config["general"].get("device_pool_workers", "0"))
+        except ValueError:
+            logging.warning("Invalid device_pool_workers, using one thread per device.")
+            n_workers = 0
+        if n_workers > 0:
+            self.scheduler = DeviceScheduler(n_workers)
+        else:
+            self.scheduler = None
 
         # start control for all devices
         for dev_name, dev in self.parent.devices.items():
             if dev.config["control_params"]["enabled"]["value"]:
                 dev.clear_queues()
-                dev.start()
+                # drivers with blocking reads keep a dedicated thread
+                if self.scheduler and not getattr(dev.config["driver_class"], "dedicated_thread", False):
+                    self.scheduler.add_device(dev)
+                else:
+                    dev.start()
+        if self.scheduler:
+            self.scheduler.active.set()
+            self.scheduler.start()
 
         # update and start the monitoring thread
         self.monitoring = Monitoring(self.parent)
@@ -3160,9 +5291,10 @@ class ControlGUI(qt.QWidget):
             if self.networking.active.is_set():
                 self.networking.active.clear()
 
-        # stop HDF writer
-        if self.HDF_writer.active.is_set():
-            self.HDF_writer.active.clear()
+        # stop HDF writers
+        for writer in self.HDF_writers:
+            if writer.active.is_set():
+                writer.active.clear()
 
         # remove background color of the HDF status label
         HDF_status = self.parent.ControlGUI.HDF_status
@@ -3197,7 +5329,21 @@ class ControlGUI(qt.QWidget):
 
                 # stop the device, and wait for it to finish
                 dev.active.clear()
-                dev.join()
+                dev.wakeup.set()
+                if dev.is_alive():
+                    dev.join()
+
+        # stop the devices running on the shared worker pool
+        if self.scheduler:
+            self.status_label.setText("Stopping device worker pool ...")
+            self.parent.app.processEvents()
+            self.scheduler.stop()
+            self.scheduler = None
+
+        # send the remaining points to InfluxDB (or keep them on disk)
+        self.status_label.setText("Stopping InfluxDB writer ...")
+        self.parent.app.processEvents()
+        self.influxdb_sink.stop()
 
         # update status
         self.parent.config['control_active'] = False
@@ -3418,7 +5564,7 @@ class PlotsGUI(qt.QSplitter):
 
     def refresh_all_run_lists(self, select_defaults=True):
         # get list of runs
-        with h5py.File(self.parent.config["files"]["plotting_hdf_fname"], 'r') as f:
+        with open_hdf_for_reading(self.parent.config["files"]["plotting_hdf_fname"]) as f:
             runs = list(f.keys())
 
         # update all run QComboBoxes
@@ -3531,7 +5677,7 @@ class Plotter(qt.QWidget):
 
         # get list of runs
         try:
-            with h5py.File(self.parent.config["files"]["plotting_hdf_fname"], 'r') as f:
+            with open_hdf_for_reading(self.parent.config["files"]["plotting_hdf_fname"]) as f:
                 runs = list(f.keys())
         except OSError as err:
             runs = ["(no runs found)"]
@@ -3688,7 +5834,7 @@ class Plotter(qt.QWidget):
 
         # select latest run
         try:
-            with h5py.File(self.parent.config["files"]["plotting_hdf_fname"], 'r') as f:
+            with open_hdf_for_reading(self.parent.config["files"]["plotting_hdf_fname"]) as f:
                 self.config["run"] = list(f.keys())[-1]
                 self.run_cbx.setCurrentText(self.config["run"])
         except OSError as err:
@@ -3763,7 +5909,7 @@ class Plotter(qt.QWidget):
         if self.dev.config["control_params"]["HDF_enabled"]["value"]:
             # check run is valid
             try:
-                with h5py.File(self.parent.config["files"]["plotting_hdf_fname"], 'r') as f:
+                with open_hdf_for_reading(self.parent.config["files"]["plotting_hdf_fname"]) as f:
                     if not self.config["run"] in f.keys():
                         self.stop_animation()
                         logging.warning("Plot error: Run not found in the HDF file:" + self.config["run"])
@@ -3775,7 +5921,7 @@ class Plotter(qt.QWidget):
                     return False
 
             # check dataset exists in the run
-            with h5py.File(self.parent.config["files"]["plotting_hdf_fname"], 'r') as f:
+            with open_hdf_for_reading(self.parent.config["files"]["plotting_hdf_fname"]) as f:
                 try:
                     grp = f[self.config["run"] + "/" + self.dev.config["path"]]
                 except KeyError:
@@ -3804,11 +5950,11 @@ class Plotter(qt.QWidget):
             self.toggle_HDF_or_queue()
             return
 
-        with h5py.File(self.parent.config["files"]["plotting_hdf_fname"], 'r') as f:
+        with open_hdf_for_reading(self.parent.config["files"]["plotting_hdf_fname"]) as f:
             grp = f[self.config["run"] + "/" + self.dev.config["path"]]
 
             if self.dev.config["slow_data"]:
-                dset = grp[self.dev.config["name"]]
+                dset = refresh_dataset(grp[self.dev.config["name"]])
                 x = dset[self.config["x"]]
                 y = dset[self.config["y"]]
 
@@ -3817,51 +5963,41 @@ class Plotter(qt.QWidget):
                     y /= dset[self.config["z"]]
 
             if not self.dev.config["slow_data"]:
-                # find the latest record
-                rec_num = len(grp) - 1
-
-                # get the latest curve
-                try:
-                    dset = grp[self.dev.config["name"] + "_" + str(rec_num)]
-                except KeyError as err:
-                    logging.warning("Plot error: not found in HDF: " + str(err))
-                    logging.warning(traceback.format_exc())
+                # get the latest curves, as (samples, channels) arrays
+                traces, attrs = read_fast_traces(grp, self.dev.config["name"], max(self.config["n_average"], 1))
+                if not traces:
+                    logging.warning("Plot error: no traces found in HDF for " + self.dev.config["name"])
                     return None
+                dset = traces[0]
+                self.dset_attrs = attrs[::-1]
 
                 if self.config['x'] == "(none)":
-                    x = np.arange(dset[0].shape[2])
+                    x = np.arange(dset.shape[0])
                 else:
-                    x = dset[0][0, self.param_list.index(self.config["x"])].astype(float)
+                    x = dset[:, self.param_list.index(self.config["x"])].astype(float)
                 if self.config["y"] == "(none)":
                     logging.warning("Plot error: y not valid.")
                     logging.warning("Plot warning: bad parameters")
                     return None
-                y = dset[:, self.param_list.index(self.config["y"])].astype(np.float)
+                y = dset[:, self.param_list.index(self.config["y"])].astype(float)
 
                 # divide y by z (if applicable)
                 if self.config["z"] in self.param_list:
                     y = y / dset[:, self.param_list.index(self.config["z"])]
 
                 # average sanity check
-                if self.config["n_average"] > len(grp):
+                if self.config["n_average"] > len(traces):
                     logging.warning("Plot error: Cannot average more traces than exist.")
                     return x, y
 
                 # average last n curves (if applicable)
-                for i in range(self.config["n_average"] - 1):
-                    try:
-                        dset = grp[self.dev.config["name"] + "_" + str(rec_num-i)]
-                    except KeyError as err:
-                        logging.warning("Plot averaging error: " + str(err))
-                        logging.warning(traceback.format_exc())
-                        break
+                for dset in traces[1:]:
                     if self.config["z"] in self.param_list:
                         y += dset[:, self.param_list.index(self.config["y"])] \
                                 / dset[:, self.param_list.index(self.config["z"])]
                     else:
                         y += dset[:, self.param_list.index(self.config["y"])]
-                if self.config["n_average"] > 0:
-                    y = y / self.config["n_average"]
+                y = y / len(traces)
 
         return x, y
 
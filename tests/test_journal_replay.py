@@ -0,0 +1,147 @@
+"""
+Replaying a journal into a run, as done at startup for a journal left over by a
+crash. Needs the program's dependencies (h5py, PyQt5, ...);
+run from the repository root with
+
+    python -m pytest tests
+"""
+
+import sys
+import json
+import numpy as np
+import pytest
+from pathlib import Path
+from collections import deque
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+main = pytest.importorskip("main")
+h5py = pytest.importorskip("h5py")
+
+class HeadlessParent:
+    def __init__(self, config, devices):
+        self.config = config
+        self.devices = devices
+        self.ControlGUI = self
+
+    def n_HDF_shards(self):
+        return 1
+
+    def update_HDF_status(self):
+        pass
+
+def fast_device(compression, layout="extendable"):
+    return main.Device({
+            "name"               : "fast",
+            "path"               : "test",
+            "slow_data"          : False,
+            "meta_device"        : False,
+            "double_connect_dev" : False,
+            "compound_dataset"   : False,
+            "plots_queue_maxlen" : 10,
+            "max_NaN_count"      : 10,
+            "telemetry_dt"       : 0,
+            "shape"              : (1, 2, 100),
+            "dtype"              : "int16",
+            "fast_data_layout"   : layout,
+            "compression"        : compression,
+            "compression_level"  : "",
+            "shuffle"            : True,
+            "attributes"         : {"column_names": "ch0,ch1", "units": ","},
+            "control_params"     : {
+                "enabled"     : {"value": 2},
+                "HDF_enabled" : {"value": 1},
+                "dt"          : {"value": 0.1},
+            },
+        })
+
+@pytest.mark.parametrize("compression", ["gzip", "lzf"])
+def test_replay_into_compressed_extendable_dataset(tmp_path, compression):
+    devices = {"fast": fast_device(compression)}
+    parent = HeadlessParent({
+            "general"        : {"run_name": "test"},
+            "files"          : {"hdf_fname": str(tmp_path / "test.hdf")},
+            "run_attributes" : {},
+            "time_offset"    : 0,
+        }, devices)
+
+    # the run as created at the start of control, before the crash
+    writer = main.HDF_writer(parent)
+    writer.compression_pool.shutdown()
+
+    # journal records that weren't written
+    rng = np.random.default_rng(0)
+    records = rng.integers(-1000, 1000, (3, 2, 100)).astype(np.int16)
+    all_attrs = [{"timestamp": float(i)} for i in range(3)]
+    journal = main.Journal(str(tmp_path / "test.journal"), writer.filename, writer.run_name)
+    journal.append("fast", "data", [records, all_attrs], deque())
+    journal.close(remove=False)
+
+    # replayed as ControlGUI.replay_journal() does
+    hdf_fname, run_name, journal_records = main.Journal.read(str(tmp_path / "test.journal"))
+    main.HDF_writer(parent, hdf_fname, run_name).replay_journal(journal_records)
+
+    with h5py.File(hdf_fname, "r") as f:
+        grp = f[run_name]["test"]
+        assert grp["fast"].compression == compression
+        np.testing.assert_array_equal(grp["fast"][()], records)
+        attrs = grp["fast_attrs"][()]
+        assert list(attrs["record"]) == [0, 1, 2]
+        assert [json.loads(a)["timestamp"] for a in attrs["attrs"]] == [0.0, 1.0, 2.0]
+
+def test_replay_before_connecting_keeps_unwritten_records(tmp_path):
+    devices = {"fast": fast_device("", layout="datasets")}
+    parent = HeadlessParent({
+            "general"        : {"run_name": "test"},
+            "files"          : {"hdf_fname": str(tmp_path / "test.hdf")},
+            "run_attributes" : {},
+            "time_offset"    : 0,
+        }, devices)
+    writer = main.HDF_writer(parent)
+    writer.compression_pool.shutdown()
+
+    # at startup the devices aren't connected, so their dtype isn't known
+    del devices["fast"].config["dtype"]
+
+    rng = np.random.default_rng(0)
+    records = rng.integers(-1000, 1000, (2, 2, 100)).astype(np.int16)
+    all_attrs = [{"timestamp": float(i)} for i in range(2)]
+    journal_records = [
+            ("gone", "data", [[0.0, 1.0]]),
+            ("fast", "data", [records, all_attrs]),
+        ]
+    not_replayed = main.HDF_writer(parent, writer.filename, writer.run_name).replay_journal(journal_records)
+
+    # the records of devices no longer configured are handed back
+    assert not_replayed == journal_records[:1]
+    with h5py.File(writer.filename, "r") as f:
+        grp = f[writer.run_name]["test"]
+        for i in range(2):
+            assert grp["fast_" + str(i)].dtype == np.int16
+            np.testing.assert_array_equal(grp["fast_" + str(i)][()], records[i].T)
+
+@pytest.mark.parametrize("compression", ["", "gzip"])
+def test_replay_drops_mismatched_records(tmp_path, compression):
+    devices = {"fast": fast_device(compression)}
+    parent = HeadlessParent({
+            "general"        : {"run_name": "test"},
+            "files"          : {"hdf_fname": str(tmp_path / "test.hdf")},
+            "run_attributes" : {},
+            "time_offset"    : 0,
+        }, devices)
+    writer = main.HDF_writer(parent)
+    writer.compression_pool.shutdown()
+
+    # a record of the wrong shape between two good ones
+    rng = np.random.default_rng(0)
+    records = [rng.integers(-1000, 1000, shape).astype(np.int16) for shape in [(2, 100), (2, 50), (2, 100)]]
+    all_attrs = [{"timestamp": float(i)} for i in range(3)]
+    journal_records = [("fast", "data", [records, all_attrs])]
+    main.HDF_writer(parent, writer.filename, writer.run_name).replay_journal(journal_records)
+
+    # the good records are written, with their attrs alongside
+    with h5py.File(writer.filename, "r") as f:
+        grp = f[writer.run_name]["test"]
+        np.testing.assert_array_equal(grp["fast"][()], np.stack([records[0], records[2]]))
+        attrs = grp["fast_attrs"][()]
+        assert list(attrs["record"]) == [0, 1]
+        assert list(attrs["timestamp"]) == [0.0, 2.0]